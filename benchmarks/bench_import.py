@@ -0,0 +1,65 @@
+"""Import-time benchmark for the in-pipeline ``getSnake`` path.
+
+Each sample runs in a fresh interpreter that imports ``snakehelper.SnakeIOHelper``
+and calls ``getSnake`` with an injected ``snakemake`` object, which is what
+every script executed by Snakemake does. The results are printed as JSON.
+
+Usage:
+    python benchmarks/bench_import.py [--repeat 20] [--output results.json]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+_PROBE = r'''
+import sys, time
+from types import SimpleNamespace
+t0 = time.perf_counter()
+from snakehelper.SnakeIOHelper import getSnake
+t1 = time.perf_counter()
+fake = SimpleNamespace(input=['in.txt'], output=['out.txt'], log=[])
+getSnake({'snakemake': fake}, '', [], '', createFolder=False)
+t2 = time.perf_counter()
+heavy = sorted({m.split('.')[0] for m in sys.modules} & {'snakemake', 'loguru'})
+print(f'{t1 - t0} {t2 - t1} {",".join(heavy)}')
+'''
+
+
+def run(repeat):
+    import_times, call_times, heavy = [], [], set()
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', _PROBE], check=True,
+                             capture_output=True, text=True).stdout.split()
+        import_times.append(float(out[0]))
+        call_times.append(float(out[1]))
+        if len(out) > 2:
+            heavy.update(out[2].split(','))
+    return {
+        'benchmark': 'import',
+        'repeat': repeat,
+        'import_s_median': statistics.median(import_times),
+        'import_s_min': min(import_times),
+        'in_pipeline_call_s_median': statistics.median(call_times),
+        'heavy_modules_imported': sorted(heavy),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    result = run(args.repeat)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
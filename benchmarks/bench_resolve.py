@@ -0,0 +1,172 @@
+"""Resolution benchmark on synthetic workflows of configurable size.
+
+A synthetic Snakefile has ``--branches`` independent pipelines of ``--depth``
+rules each, all with a ``{sample}`` wildcard. Every sample is a target, so the
+DAG has ``branches * depth * fanout`` jobs. With ``--input-functions`` the rules
+take their input from a function instead of a pattern.
+
+Each case runs ``getSnake`` in a fresh interpreter, so Snakemake import and
+workflow compile are part of the measurement as they are for a script. The
+time of each phase (see ``snakehelper.timing``) and the peak resident memory
+are recorded. The results are printed as JSON.
+
+Usage:
+    python benchmarks/bench_resolve.py [--fanout 10 100 1000 10000] [--depth 3]
+        [--branches 2] [--modes full virtual pruned] [--input-functions]
+        [--repeat 3] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+_RULE = '''
+rule {name}:
+    input: {input}
+    output: 'out/b{branch}/r{level}/{{sample}}.txt'
+    log: 'logs/b{branch}/r{level}/{{sample}}.log'
+    params: level={level}
+    shell: 'touch {{output}}'
+'''
+
+
+def generate_workflow(path, branches, depth, input_functions=False):
+    """Write a synthetic Snakefile and return the name of its last rule.
+
+    Args:
+        path (str): Snakefile to write
+        branches (int): Number of independent pipelines
+        depth (int): Rules per pipeline
+        input_functions (bool): Declare inputs with functions instead of patterns
+    """
+    parts = []
+    for branch in range(branches):
+        for level in range(depth):
+            upstream = 'raw/{sample}.dat' if level == 0 else f'out/b{branch}/r{level - 1}/{{sample}}.txt'
+            if input_functions:
+                source = upstream.replace('{sample}', '{wc.sample}')
+                input_ = f"lambda wc: f'{source}'"
+            else:
+                input_ = repr(upstream)
+            parts.append(_RULE.format(name=f'b{branch}_r{level}', input=input_,
+                                      branch=branch, level=level))
+    Path(path).write_text(''.join(parts))
+    return f'b0_r{depth - 1}'
+
+
+def targets_for(branches, depth, fanout):
+    return [f'out/b{b}/r{depth - 1}/s{i}.txt' for b in range(branches) for i in range(fanout)]
+
+
+def _run_case(case):
+    """Resolve one case in this process and print its measurements."""
+    import resource
+    import time
+
+    os.chdir(case['workdir'])
+    t0 = time.perf_counter()
+    from snakehelper.SnakeIOHelper import getSnake
+    t1 = time.perf_counter()
+    _in, _out, job = getSnake(
+        {}, case['snakefile'], case['targets'], case['rule'], change_working_dir=False,
+        createFolder=False, return_snake_obj=True, memory_cache=False, use_daemon=False,
+        prune_dag=case['mode'] == 'pruned', virtual_inputs=case['mode'] == 'virtual')
+    t2 = time.perf_counter()
+    print(json.dumps({
+        'import_s': t1 - t0,
+        'resolve_s': t2 - t1,
+        'phases': job.timing.to_dict()['phases'],
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }))
+
+
+def run_case(workdir, snakefile, targets, rule, mode, repeat):
+    case = {'workdir': workdir, 'snakefile': snakefile, 'targets': targets, 'rule': rule,
+            'mode': mode}
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case'],
+                             input=json.dumps(case), check=True, capture_output=True,
+                             text=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    resolve = [s['resolve_s'] for s in samples]
+    phases = {}
+    for s in samples:
+        for name, p in s['phases'].items():
+            phases.setdefault(name, []).append(p['seconds'])
+    return {
+        'mode': mode,
+        'resolve_s_median': statistics.median(resolve),
+        'resolve_s_min': min(resolve),
+        'import_s_median': statistics.median(s['import_s'] for s in samples),
+        'phases_s_median': {name: statistics.median(v) for name, v in phases.items()},
+        'peak_rss_kb_max': max(s['peak_rss_kb'] for s in samples),
+    }
+
+
+def run(fanouts, depth, branches, modes, input_functions, repeat, missing_raw=False):
+    from importlib.metadata import version
+
+    results = []
+    for fanout in fanouts:
+        with tempfile.TemporaryDirectory(prefix='snakehelper-bench-') as workdir:
+            snakefile = os.path.join(workdir, 'Snakefile')
+            rule = generate_workflow(snakefile, branches, depth, input_functions)
+            if not missing_raw:
+                os.makedirs(os.path.join(workdir, 'raw'))
+                for i in range(fanout):
+                    Path(workdir, 'raw', f's{i}.dat').touch()
+            targets = targets_for(branches, depth, fanout)
+            for mode in modes:
+                result = run_case(workdir, snakefile, targets, rule, mode, repeat)
+                result.update(fanout=fanout, depth=depth, branches=branches,
+                              rules=branches * depth, jobs=branches * depth * fanout,
+                              input_functions=input_functions, missing_raw=missing_raw)
+                results.append(result)
+    return {
+        'benchmark': 'resolve',
+        'repeat': repeat,
+        'python': platform.python_version(),
+        'snakemake': version('snakemake'),
+        'snakehelper': version('snakehelper'),
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fanout', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Samples per rule; one run per value')
+    parser.add_argument('--depth', type=int, default=3, help='Rules per pipeline')
+    parser.add_argument('--branches', type=int, default=2, help='Independent pipelines')
+    parser.add_argument('--modes', nargs='+', default=['full', 'virtual', 'pruned'],
+                        choices=['full', 'virtual', 'pruned'])
+    parser.add_argument('--input-functions', action='store_true')
+    parser.add_argument('--missing-raw', action='store_true',
+                        help='Do not create the raw input files')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--run-case', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        _run_case(json.load(sys.stdin))
+        return
+
+    result = run(args.fanout, args.depth, args.branches, args.modes, args.input_functions,
+                 args.repeat, args.missing_raw)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
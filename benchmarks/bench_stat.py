@@ -0,0 +1,133 @@
+"""Filesystem metadata calls made while resolving a workflow, with injected latency.
+
+The ``os`` metadata functions (``stat``, ``lstat``, ``scandir``, ``listdir``,
+``access`` and the ``os.path`` checks) are wrapped so that every call on a
+file of the synthetic workflow is counted and delayed by ``--latency``
+milliseconds, as on a slow network filesystem. Each resolution mode runs in a
+fresh interpreter. With ``stat_free`` the number of calls is zero. The
+results are printed as JSON.
+
+Usage:
+    python benchmarks/bench_stat.py [--fanout 200] [--latency 2]
+        [--modes full virtual stat_free pruned] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from bench_resolve import generate_workflow, targets_for
+
+_OS_FUNCTIONS = ('stat', 'lstat', 'scandir', 'listdir', 'access')
+_PATH_FUNCTIONS = ('exists', 'lexists', 'isdir', 'isfile', 'islink', 'getmtime', 'getsize')
+
+
+def _install_latency(roots, latency, counts):
+    """Wrap the metadata functions so calls below ``roots`` are counted and delayed."""
+    import time
+
+    roots = tuple(os.path.join(r, '') for r in roots)
+
+    def wrap(module, name):
+        original = getattr(module, name)
+
+        def wrapper(*args, **kwargs):
+            path = args[0] if args else kwargs.get('path')
+            if isinstance(path, (str, bytes, os.PathLike)) and \
+                    os.path.abspath(os.fsdecode(path)).startswith(roots):
+                counts[name] = counts.get(name, 0) + 1
+                time.sleep(latency)
+            return original(*args, **kwargs)
+
+        setattr(module, name, wrapper)
+
+    for name in _OS_FUNCTIONS:
+        wrap(os, name)
+    for name in _PATH_FUNCTIONS:
+        wrap(os.path, name)
+
+
+def _run_case(case):
+    import time
+
+    os.chdir(case['workdir'])
+    from snakehelper.SnakeIOHelper import IOParser
+
+    counts = {}
+    _install_latency([os.path.join(case['workdir'], d) for d in ('raw', 'out', 'logs')],
+                     case['latency'], counts)
+    options = {
+        'full': {},
+        'virtual': {'virtual_inputs': True},
+        'stat_free': {'stat_free': True},
+        'pruned': {'pruned': True, 'rule': case['rule']},
+    }[case['mode']]
+    t0 = time.perf_counter()
+    parser = IOParser(case['snakefile'], case['targets'], **options)
+    elapsed = time.perf_counter() - t0
+    print(json.dumps({
+        'mode': case['mode'],
+        'jobs': len(list(parser.iter_jobs())),
+        'metadata_calls': sum(counts.values()),
+        'metadata_calls_by_function': counts,
+        'build_dag_s': parser.timing.phases['build_dag'].seconds,
+        'resolve_s': elapsed,
+    }))
+
+
+def run(fanout, depth, branches, latency_ms, modes):
+    results = []
+    with tempfile.TemporaryDirectory(prefix='snakehelper-bench-') as workdir:
+        snakefile = os.path.join(workdir, 'Snakefile')
+        rule = generate_workflow(snakefile, branches, depth)
+        os.makedirs(os.path.join(workdir, 'raw'))
+        for i in range(fanout):
+            Path(workdir, 'raw', f's{i}.dat').touch()
+        case = {'workdir': workdir, 'snakefile': snakefile, 'rule': rule,
+                'targets': targets_for(branches, depth, fanout), 'latency': latency_ms / 1000}
+        for mode in modes:
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case'],
+                                 input=json.dumps({**case, 'mode': mode}), check=True,
+                                 capture_output=True, text=True).stdout
+            results.append(json.loads(out.strip().splitlines()[-1]))
+    return {
+        'benchmark': 'stat',
+        'fanout': fanout,
+        'depth': depth,
+        'branches': branches,
+        'latency_ms': latency_ms,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fanout', type=int, default=200, help='Samples per rule')
+    parser.add_argument('--depth', type=int, default=3, help='Rules per pipeline')
+    parser.add_argument('--branches', type=int, default=2, help='Independent pipelines')
+    parser.add_argument('--latency', type=float, default=2.0,
+                        help='Milliseconds added to each metadata call')
+    parser.add_argument('--modes', nargs='+', default=['full', 'virtual', 'stat_free', 'pruned'],
+                        choices=['full', 'virtual', 'stat_free', 'pruned'])
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--run-case', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        _run_case(json.load(sys.stdin))
+        return
+
+    result = run(args.fanout, args.depth, args.branches, args.latency, args.modes)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
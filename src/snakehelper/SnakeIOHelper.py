@@ -1,48 +1,111 @@
-"""Helper utilities for working with Snakemake I/O in scripts (Snakemake >= 9)."""
+"""Helper utilities for working with Snakemake I/O in scripts (Snakemake >= 9).
+
+Snakemake and loguru are imported lazily: a script running inside a Snakemake
+job only reads the injected ``snakemake`` object and should not pay for
+importing Snakemake a second time.
+"""
 
 import os
+from collections.abc import Mapping
 from pathlib import Path
 from types import SimpleNamespace
-
-from snakemake.api import DAGSettings as _SMDAGSettings
-from snakemake.api import SnakemakeApi as _SMSnakemakeApi
-from snakemake.settings.types import ResourceSettings as _SMResourceSettings
-from loguru import logger
 import sys
+import threading
+
+
+def __getattr__(name):
+    # Keep ``from snakehelper.SnakeIOHelper import logger`` working without
+    # importing loguru at module import time
+    if name == 'logger':
+        from loguru import logger
+        return logger
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def _event_loop_running():
+    """Whether an asyncio event loop is running in this thread (e.g. in Jupyter)."""
+    import asyncio
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
 
 
-def _apply_jupyter_asyncio_patch():
-    """Apply nest_asyncio patch if running in Jupyter environment.
+def _path_or_uri(source_file, secret_free=True):
+    """Path or URI of a Snakemake source file.
 
-    This allows Snakemake's asyncio code to run inside Jupyter notebooks,
-    which already have an active event loop.
+    ``get_path_or_uri`` only takes the ``secret_free`` keyword from Snakemake 9.14 on;
+    earlier releases take no arguments.
     """
     try:
-        # Check if we're in an IPython/Jupyter environment
-        get_ipython()  # This will raise NameError if not in IPython
+        return source_file.get_path_or_uri(secret_free=secret_free)
+    except TypeError:
+        return source_file.get_path_or_uri()
 
-        # Check if there's already a running event loop
-        import asyncio
-        try:
-            asyncio.get_running_loop()
-            # If we got here, there's a running loop - apply the patch
-            import nest_asyncio
-            nest_asyncio.apply()
-        except RuntimeError:
-            # No running loop, no need to patch
-            pass
-    except (NameError, ImportError):
-        # Not in IPython/Jupyter or nest_asyncio not available
-        pass
 
-def makeFolders(output):
+def _async_run(workflow, coroutine):
+    """Run a coroutine of Snakemake's DAG to completion.
+
+    ``Workflow.async_run`` only exists in recent Snakemake releases; earlier ones
+    provide the module-level ``snakemake.common.async_run`` instead.
+    """
+    run = getattr(workflow, 'async_run', None)
+    if run is None:
+        from snakemake.common import async_run as run
+    return run(coroutine)
+
+
+# Serialises workflow compiles between threads: compileWorkflow swaps
+# sys.stderr and Snakemake keeps process-wide state while building a DAG
+_compile_lock = threading.Lock()
+
+# Absolute paths of folders created or seen by makeFolders. Repeated calls only
+# check that the deepest of them still exist instead of trying to create them.
+_known_folders = set()
+
+
+def _is_directory_output(value):
+    """Whether an output value denotes a directory rather than a file.
+
+    Snakemake outputs carry a ``directory`` flag when wrapped in ``directory()``.
+    Plain strings have no flags, so a path without a suffix is taken as a folder.
+    """
+    flags = getattr(value, 'flags', None)
+    if flags is not None:
+        return bool(flags.get('directory'))
+    return Path(str(value)).suffix == ''
+
+
+def _create_folder(path):
+    """Create ``path`` and return True, or False if it already existed."""
+    try:
+        os.makedirs(path)
+        return True
+    except FileExistsError:
+        return False
+
+
+def makeFolders(output, max_workers=16):
     """Create folders for output paths if they do not exist.
 
     Supports Snakemake ``Namedlist``/``OutputFiles`` across versions, simple
     iterables, dict-like objects, and simple namespaces.
+
+    Folders are deduplicated (a folder is skipped when a subfolder of it is
+    created anyway), and the remaining ones are created concurrently. Folders
+    created or seen by earlier calls are remembered and only checked with one
+    ``os.path.isdir`` each, so a folder deleted since, e.g. between two runs of
+    a notebook cell, is created again. A single summary line is printed instead
+    of one line per folder.
     """
 
     def _iter_output_values(obj):
+        # Snakemake Namedlists are lists; iterate them directly so unnamed
+        # entries and expanded lists are included
+        if isinstance(obj, (list, tuple, set)):
+            yield from obj
+            return
         # Prefer mapping-style APIs when available
         if hasattr(obj, 'items'):
             for _, v in obj.items():
@@ -69,21 +132,54 @@ def makeFolders(output):
         # Last resort: treat the object itself as a single path value
         yield obj
 
+    folders = set()
     for v in _iter_output_values(output):
-        p = Path(str(v))
-        if p.suffix == '':  # looks like a directory
-            if not os.path.exists(p):
-                os.makedirs(p)
-                print('Created folder:' + str(p))
-        else:
-            parent = p.parent
-            if not os.path.exists(parent):
-                os.makedirs(parent)
-                print('Created folder:' + str(parent))
+        p = Path(str(v)).absolute()
+        folders.add(p if _is_directory_output(v) else p.parent)
+
+    # Only the deepest folders need creating; makedirs creates their parents
+    parents = {parent for f in folders for parent in f.parents}
+    leaves = [f for f in sorted(folders - parents)
+              if f not in _known_folders or not os.path.isdir(f)]
+    if not leaves:
+        _known_folders.update(folders)
+        return
+
+    if len(leaves) == 1 or max_workers <= 1:
+        created = [f for f in leaves if _create_folder(f)]
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(leaves))) as pool:
+            created = [f for f, new in zip(leaves, pool.map(_create_folder, leaves)) if new]
+
+    _known_folders.update(folders)
+    _known_folders.update(parents)
+    if created:
+        shown = ', '.join(map(str, created[:3]))
+        more = f' and {len(created) - 3} more' if len(created) > 3 else ''
+        print(f'Created {len(created)} folder(s): {shown}{more}')
+
+def _parser_options(rule, pruned=False, virtual_inputs=False, stat_free=False):
+    """Return the ``IOParser`` keyword arguments for a resolution mode.
+
+    Only non-default options are included, so that equivalent modes share
+    cache entries.
+    """
+    options = {}
+    if pruned:
+        options.update(pruned=True, rule=rule)
+    if virtual_inputs:
+        options['virtual_inputs'] = True
+    if stat_free:
+        options['stat_free'] = True
+    return options
 
 def getSnake(locals:dict,snakefile:str, targets:list,
              rule:str, redirect_error  = True,
-            createFolder:bool = True, return_snake_obj=False, change_working_dir=True):
+            createFolder:bool = True, return_snake_obj=False, change_working_dir=True,
+            cache_dir=None, memory_cache=True, use_daemon=True, prune_dag=False,
+            watch=False, virtual_inputs=False, multiprocess_logging=False, timing_file=None,
+            compact=False, stat_free=False):
     """Return the input and output files according to a snakemake file, target and running rule
 
     Args:
@@ -92,94 +188,394 @@ def getSnake(locals:dict,snakefile:str, targets:list,
     targets (list): The file or files that are created when the rule is executed
     rule (str): The rule for which you want to determine the input and output files
     createFolder (bool): Whether or not to create output folders. Default is True.
+    cache_dir (str): Directory of the persistent resolution cache. Defaults to the
+        ``SNAKEHELPER_CACHE_DIR`` environment variable; caching is off if neither is set.
+        On a cache hit the returned snake object is a ``ResolvedIO`` record instead of a Job.
+    memory_cache (bool): Reuse compiled workflows kept in memory by earlier calls in this
+        process (see ``snakehelper.cache.parser_cache``). Default is True.
+    use_daemon (bool): Ask a running ``snakehelper serve`` daemon to resolve the rule
+        before compiling the workflow locally. Default is True. The daemon is only asked
+        when no snake object is requested or ``compact`` is True, since it returns a
+        ``ResolvedIO`` record rather than the Snakemake Job.
+    prune_dag (bool): Only build the job of ``rule`` that produces the targets instead of
+        the whole upstream DAG. Default is False.
+    watch (bool): Keep the compiled workflow in a background watcher that recompiles it
+        when the Snakefile, its includes or config files change (see ``snakehelper.watch``).
+        Default is False.
+    virtual_inputs (bool): Treat raw inputs missing on disk as present while building the DAG,
+        instead of creating placeholder files and dry-running the workflow twice. Default is False.
+    multiprocess_logging (bool): Let worker processes of the script log to the rule's log
+        file through a queue (see ``prepare_logger``). Default is False.
+    timing_file (str): Append the wall time and call count of each phase of this call as a
+        JSON line to this file. Defaults to the ``SNAKEHELPER_TIMING_FILE`` environment
+        variable. The timings are also available as ``timing`` on the returned snake object.
+    compact (bool): Return the input, output and snake object from a picklable ``ResolvedIO``
+        record (input, output, log, params, wildcards, threads and resources) instead of the
+        Snakemake Job, so the DAG and workflow are not kept alive. A workflow compiled for
+        this call is not added to the in-memory cache either. Default is False.
+    stat_free (bool): Build the DAG without any existence or timestamp check of its files,
+        assuming every input is present. Use it on filesystems with slow metadata calls
+        (NFS, Lustre). Default is False.
 
     Returns:
     Tuple: A tuple of dictionaries containing input and output file names, as defined in the snakemake file.
     """
 
-    if 'snakemake' not in locals:
-        #We are running standlone mode
+    from .timing import PhaseTimer, get_timing_file
 
-        #Auto switch to project root folder if SNAKE_ROOT is set
-        snake_root = os.environ.get('SNAKEMAKE_DEBUG_ROOT')
-        if snake_root is not None and change_working_dir:
-            print('Changing working directory to:' + snake_root)
-            os.chdir(snake_root)
+    timer = PhaseTimer()
+    try:
+        if 'snakemake' not in locals:
+            return _get_snake_standalone(
+                snakefile, targets, rule, timer, redirect_error=redirect_error,
+                createFolder=createFolder, return_snake_obj=return_snake_obj,
+                change_working_dir=change_working_dir, cache_dir=cache_dir,
+                memory_cache=memory_cache, use_daemon=use_daemon, prune_dag=prune_dag,
+                watch=watch, virtual_inputs=virtual_inputs,
+                multiprocess_logging=multiprocess_logging, compact=compact,
+                stat_free=stat_free)
 
-        parser = None
-        try:
-            parser = IOParser(snakefile, targets)
-            io = parser.getInputOutput4rule(rule)
-            if createFolder:
-                makeFolders(io.output)
+        snake = locals['snakemake']
+        if compact:
+            from .resolved import ResolvedIO
+            snake = ResolvedIO.from_job(snake)
+        if createFolder:
+            with timer.phase('make_folders'):
+                makeFolders(snake.output)
 
-            if redirect_error and createFolder:
-                if len(io.log) > 0 :
-                    logfile = io.log[0]
-                    prepare_logger(logfile)
+        if redirect_error and createFolder:
+            if hasattr(snake, 'log') and len(snake.log) > 0:
+                logfile = snake.log[0]
+                with timer.phase('prepare_logger'):
+                    prepare_logger(logfile, multiprocess=multiprocess_logging)
+
+        if return_snake_obj:
+            _attach_timing(snake, timer)
+            return (snake.input, snake.output, snake)
+        else:
+            return (snake.input, snake.output)
+    finally:
+        timing_file = get_timing_file(timing_file)
+        if timing_file is not None:
+            timer.write_trace(timing_file, snakefile=snakefile, rule=rule,
+                              targets=[str(t) for t in targets],
+                              in_pipeline='snakemake' in locals)
+
+
+def _change_to_debug_root():
+    #Auto switch to project root folder if SNAKE_ROOT is set
+    snake_root = os.environ.get('SNAKEMAKE_DEBUG_ROOT')
+    if snake_root is not None:
+        print('Changing working directory to:' + snake_root)
+        os.chdir(snake_root)
+
+
+async def get_snake_async(locals:dict, snakefile:str, targets:list, rule:str,
+                          executor:str = 'thread', **kwargs):
+    """Awaitable ``getSnake`` that resolves the workflow without blocking the event loop.
+
+    Use it with ``await`` in a Jupyter cell; the kernel stays responsive while
+    the DAG is built.
+
+    Args:
+    locals (dict): Local variables dictionary of caller script
+    snakefile (str): Snakefile location
+    targets (list): Target files
+    rule (str): The rule for which you want to determine the input and output files
+    executor (str): ``'thread'`` compiles the workflow in a worker thread; compiles of
+        concurrent calls then run one after the other. ``'process'`` compiles it in a
+        worker process, so several calls resolve in parallel; the snake object is then
+        a ``ResolvedIO`` record (see ``compact``). Default is ``'thread'``.
+    **kwargs: Further arguments of ``getSnake``
+
+    Returns:
+    Tuple: The same as ``getSnake``.
+    """
+    import asyncio
+
+    if 'snakemake' in locals:
+        # Nothing to compile inside a Snakemake job
+        return getSnake(locals, snakefile, targets, rule, **kwargs)
+    if executor == 'thread':
+        return await asyncio.to_thread(getSnake, locals, snakefile, targets, rule, **kwargs)
+    if executor != 'process':
+        raise ValueError(f"executor must be 'thread' or 'process', not {executor!r}")
+
+    createFolder = kwargs.pop('createFolder', True)
+    redirect_error = kwargs.pop('redirect_error', True)
+    return_snake_obj = kwargs.pop('return_snake_obj', False)
+    multiprocess_logging = kwargs.pop('multiprocess_logging', False)
+    kwargs.pop('compact', None)
+    if kwargs.pop('change_working_dir', True):
+        _change_to_debug_root()
+
+    loop = asyncio.get_running_loop()
+    record, timing = await loop.run_in_executor(
+        _get_process_pool(), _resolve_in_worker, snakefile, list(targets), rule, os.getcwd(),
+        kwargs)
+    record.timing = timing
+
+    if createFolder:
+        makeFolders(record.output)
+    if redirect_error and createFolder and len(record.log) > 0:
+        prepare_logger(record.log[0], multiprocess=multiprocess_logging)
+
+    if return_snake_obj:
+        return (record.input, record.output, record)
+    return (record.input, record.output)
+
+
+_process_pool = None
+
+
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Forking a Jupyter kernel with its threads is unsafe, so workers are spawned
+        _process_pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+    return _process_pool
+
+
+def _resolve_in_worker(snakefile, targets, rule, cwd, kwargs):
+    os.chdir(cwd)
+    _in, _out, record = getSnake({}, snakefile, targets, rule, createFolder=False,
+                                 return_snake_obj=True, change_working_dir=False, compact=True,
+                                 **kwargs)
+    return record, record.timing
+
+
+def _attach_timing(snake, timer):
+    """Expose the phase timings as ``snake.timing`` where the object allows it."""
+    try:
+        snake.timing = timer
+    except AttributeError:
+        pass
+
+
+def _get_snake_standalone(snakefile, targets, rule, timer, redirect_error, createFolder,
+                          return_snake_obj, change_working_dir, cache_dir, memory_cache,
+                          use_daemon, prune_dag, watch, virtual_inputs, multiprocess_logging,
+                          compact, stat_free):
+    """Resolve ``rule`` outside of a Snakemake job (see ``getSnake``)."""
+    if change_working_dir:
+        _change_to_debug_root()
+
+    from .cache import ResultCache, get_cache_dir, parser_cache
+    from .resolved import ResolvedIO
+
+    cache_dir = get_cache_dir(cache_dir)
+    cache = ResultCache(cache_dir) if cache_dir is not None else None
+
+    # Keyword arguments of IOParser; they also key the in-memory caches
+    parser_options = _parser_options(rule, pruned=prune_dag, virtual_inputs=virtual_inputs,
+                                     stat_free=stat_free)
+    options = tuple(sorted(parser_options.items()))
+
+    parser = None
+    lock = None
+    try:
+        io = None
+        if cache is not None:
+            with timer.phase('disk_cache'):
+                try:
+                    io = cache.get(snakefile, targets, rule)
+                except OSError:
+                    cache = None  # the cache is an optimisation; resolve without it
+        if io is None:
+            from .prefetch import collect
+            with timer.phase('prefetch_wait'):
+                prefetched = collect(snakefile, targets, rule, parser_options)
+            if isinstance(prefetched, ResolvedIO):
+                io = prefetched
+            elif prefetched is not None:
+                parser = prefetched
+                if memory_cache and not compact:
+                    parser_cache.put(snakefile, targets, parser, options)
+        # The daemon's record would replace the Job that return_snake_obj asks for
+        if io is None and use_daemon and parser is None and (compact or not return_snake_obj):
+            from . import daemon
+            with timer.phase('daemon_query'):
+                io = daemon.query(snakefile, targets, rule, parser_options)
+        if io is None:
+            if parser is None and watch:
+                from .watch import get_watcher
+                with timer.phase('watcher'):
+                    parser = get_watcher(snakefile, targets, **parser_options).parser
+            elif parser is None and memory_cache:
+                with timer.phase('memory_cache'):
+                    parser = parser_cache.get(snakefile, targets, options)
+            if parser is None and cache is not None:
+                # Single-flight: of many processes missing on this key, only one compiles
+                with timer.phase('cache_lock'):
+                    try:
+                        io, lock = cache.acquire(snakefile, targets, rule)
+                    except OSError:
+                        # e.g. the cache directory is missing or read-only on this node
+                        cache = None
+        if io is None:
+            if parser is None:
+                parser = IOParser(snakefile, targets, timer=timer, **parser_options)
+                if memory_cache and not compact:
+                    parser_cache.put(snakefile, targets, parser, options)
+            with timer.phase('select_job'):
+                io = parser.getInputOutput4rule(rule)
+            if compact or cache is not None:
+                record = ResolvedIO.from_job(io)
+                if compact:
+                    io = record
+            if cache is not None:
+                with timer.phase('disk_cache'):
+                    try:
+                        cache.put(snakefile, targets, rule, record, parser.source_files)
+                    except OSError:
+                        pass  # the resolution succeeded; only the cache entry is missing
 
-            if return_snake_obj:
-                return (io.input, io.output, io)
-            else:
-                return (io.input, io.output)
-        except Exception as e:
-            # If we have a parser and it has log files, try to write the error
-            if parser is not None and hasattr(parser, 'log_files') and rule in parser.log_files:
-                parser._write_error_to_log(rule, e)
-            raise
-    else:
         if createFolder:
-            makeFolders(locals['snakemake'].output)
+            with timer.phase('make_folders'):
+                makeFolders(io.output)
 
         if redirect_error and createFolder:
-            if hasattr(locals['snakemake'], 'log') and len(locals['snakemake'].log) > 0:
-                logfile = locals['snakemake'].log[0]
-                prepare_logger(logfile)
+            if len(io.log) > 0 :
+                logfile = io.log[0]
+                with timer.phase('prepare_logger'):
+                    prepare_logger(logfile, multiprocess=multiprocess_logging)
 
         if return_snake_obj:
-            return (locals['snakemake'].input, locals['snakemake'].output, locals['snakemake'])
+            _attach_timing(io, timer)
+            return (io.input, io.output, io)
         else:
-            return (locals['snakemake'].input, locals['snakemake'].output)
+            return (io.input, io.output)
+    except Exception as e:
+        if lock is not None:
+            # Let processes waiting on our lock fail with this error instead of recompiling
+            try:
+                cache.put_failure(snakefile, targets, rule, lock, e)
+            except OSError:
+                pass
+        # If we have a parser and it has log files, try to write the error
+        if parser is not None and hasattr(parser, 'log_files'):
+            parser._write_error_to_log(rule, e)
+        raise
+    finally:
+        if lock is not None:
+            lock.release()
+
 
-     
+def prepare_logger(logfile, multiprocess=False):
+    """Send loguru records and stderr of the script to ``logfile``.
 
-def prepare_logger(logfile):
+    Args:
+    logfile (str): Log file of the rule
+    multiprocess (bool): Route records through a queue to a single writer thread in
+        this process, so that worker processes of ``multiprocessing`` or
+        ``concurrent.futures`` pools log to the same file without interleaving.
+        Forked workers inherit this automatically; spawned workers need
+        ``init_worker_logging`` as the pool initializer.
+    """
     # Save the original stderr before replacing it
     # exception will be printed to stderr, we have redicted stderr to the log file
     
+    from loguru import logger
+
     original_stderr = sys.stdout
 
+    # A StreamToLogger of an earlier call (e.g. in a Jupyter kernel) is replaced;
+    # write out its records and stop its thread before its sinks are removed
+    if isinstance(sys.stderr, StreamToLogger):
+        sys.stderr.close()
+
+    # A queue created in a spawn context can be shared with both forked and spawned workers
+    queue_options = {'enqueue': True, 'context': 'spawn'} if multiprocess else {}
+
     logger.remove()  # Remove default handler
-    logger.add(logfile, mode='w', backtrace=True, diagnose=True)
-    logger.add(original_stderr, level="ERROR")  # direct to stdout for visibility, do NOT write to stderr
+    logger.add(logfile, mode='w', backtrace=True, diagnose=True, **queue_options)
+    logger.add(original_stderr, level="ERROR", **queue_options)  # direct to stdout for visibility, do NOT write to stderr
+
+    if multiprocess:
+        import atexit
+        # Runs after StreamToLogger.close (atexit is LIFO) and waits for the writer thread
+        atexit.unregister(logger.complete)  # registered only once across calls
+        atexit.register(logger.complete)
 
     sys.stderr = StreamToLogger(logger, original_stderr)
 
 
+def init_worker_logging(logger_instance):
+    """Pool initializer connecting a spawned worker process to the parent's log file.
+
+    Use it with the logger prepared by ``getSnake(..., multiprocess_logging=True)``::
+
+        from loguru import logger
+        with ProcessPoolExecutor(initializer=init_worker_logging, initargs=(logger,)) as pool:
+            ...
+
+    The worker's global loguru logger and its stderr then send their records
+    to the writer in the parent process.
+    """
+    from loguru import logger
+
+    if hasattr(logger_instance, 'reinstall'):
+        logger_instance.reinstall()
+    else:
+        # What Logger.reinstall() does in newer loguru releases
+        logger._core = logger_instance._core
+    sys.stderr = StreamToLogger(logger)
+
+
 def makeDummpyOutput(output):
     for o in output:
         Path(o).touch()
 
 class IOParser:
-    def __init__(self, snakefile:str, targets:list):
+    # Keyword arguments of the StderrCapture used while compiling
+    stderr_capture_options = {}
+
+    def __init__(self, snakefile:str, targets:list, rule:str = None, pruned:bool = False,
+                 virtual_inputs:bool = False, stat_free:bool = False, timer=None):
+        """Compile a workflow and build the DAG for the given targets.
+
+        Args:
+        snakefile (str): Snakefile location
+        targets (list): Target files to build the DAG for
+        rule (str): Only consider this rule when ``pruned`` is True
+        pruned (bool): Only create the jobs that produce the targets, without
+            recursing into their upstream jobs or dry-running the workflow.
+            Resolution time then no longer grows with the depth of the pipeline.
+        virtual_inputs (bool): Build the full DAG in a single pass, treating raw inputs
+            that are missing on disk as present instead of creating placeholder files
+            and retrying. The paths treated this way are listed in ``missing_inputs``.
+        stat_free (bool): Like ``virtual_inputs``, but every input is assumed to exist
+            without checking the filesystem, so building the DAG makes no existence or
+            timestamp calls. ``missing_inputs`` then stays empty.
+        timer (PhaseTimer): Records the time spent in each phase of the compile.
+            A new one is created if not given; it is available as ``timing``.
+        """
+        from .timing import PhaseTimer
+
         self.snakefile = snakefile
         self.targets = targets
-        self.log_files = {}  # Will map rule names to their log files
+        self.rule = rule
+        self.pruned = pruned
+        self.virtual_inputs = virtual_inputs
+        self.stat_free = stat_free
+        self.missing_inputs = set()
+        # Maps rule names to their log files; a rule's jobs are only looked at when it is queried
+        self.log_files = _LazyLogFiles(self)
+        self.source_files = []  # Included Snakefiles and config files the workflow was built from
+        # StderrCapture of the text Snakemake wrote while compiling, until close().
+        # A failed compile attaches it to the raised exception as ``captured_stderr``.
+        self.captured_stderr = None
         self.dag = None
+        self._job_index = None
+        self.timing = timer if timer is not None else PhaseTimer()
 
-        try:
-            self.workflow = self.compileWorkflow()
-            if not hasattr(self.workflow, 'dag') or self.workflow.dag is None:
-                raise RuntimeError('Unable to access Snakemake DAG after dry-run execution')
-            self.dag = self.workflow.dag
-
-            # Extract log files from all jobs
-            self._extract_log_files()
-        except Exception as e:
-            # If we have a partially built DAG, try to extract log files from it
-            if self.dag is not None:
-                self._extract_log_files()
-            raise
+        self.workflow = self.compileWorkflow()
+        if not hasattr(self.workflow, 'dag') or self.workflow.dag is None:
+            raise RuntimeError('Unable to access Snakemake DAG after dry-run execution')
+        self.dag = self.workflow.dag
 
 
     def compileWorkflow(self):
@@ -187,106 +583,224 @@ class IOParser:
 
         Returns an object exposing a ``dag`` attribute for downstream use.
         """
-        import sys
-        from io import StringIO
+        with _compile_lock:
+            if _event_loop_running():
+                # Snakemake runs its own event loop, which it cannot do in a thread whose
+                # loop is already running (e.g. a Jupyter kernel), so compile in a helper thread
+                from concurrent.futures import ThreadPoolExecutor
+                with ThreadPoolExecutor(max_workers=1) as pool:
+                    return pool.submit(self._compile_workflow).result()
+            return self._compile_workflow()
 
-        # Apply nest_asyncio patch if running in Jupyter
-        _apply_jupyter_asyncio_patch()
+    def _compile_workflow(self):
 
-        # Capture stderr for potential logging
-        stderr_capture = StringIO()
-        old_stderr = sys.stderr
-        sys.stderr = stderr_capture
+        from .capture import StderrCapture, capture_thread_stderr
 
-        wf_api = None
-        try:
-            with _SMSnakemakeApi() as api:
-                wf_api = api.workflow(
-                    resource_settings=_SMResourceSettings(cores=1),
-                    snakefile=Path(self.snakefile),
-                    workdir=None,
-                )
-                dag_api = wf_api.dag(
-                    dag_settings=_SMDAGSettings(
-                        targets=set(self.targets),
-                        forceall=True,
-                        force_incomplete=True
-                    )
-                )
-                # execute with dryrun executor to materialize DAG
-                from snakemake.exceptions import MissingInputException
+        timer = self.timing
+        with timer.phase('import_snakemake'):
+            from snakemake.api import DAGSettings as _SMDAGSettings
+            from snakemake.api import SnakemakeApi as _SMSnakemakeApi
+            from snakemake.settings.types import ResourceSettings as _SMResourceSettings
 
-                try:
-                    dag_api.execute_workflow(executor="dryrun", updated_files=[])
-                except MissingInputException as ex:
-                    # Parse and create placeholder inputs if needed, then retry once.
-                    msg = str(ex)
-                    missing = []
-                    if "affected files:" in msg:
-                        tail = msg.split("affected files:")[-1].strip()
-                        for line in tail.splitlines():
-                            line = line.strip().lstrip("- ")
-                            if line:
-                                missing.append(line)
-                    for m in missing:
-                        p = Path(m)
-                        if p.suffix == "":
-                            p.mkdir(parents=True, exist_ok=True)
-                        else:
-                            p.parent.mkdir(parents=True, exist_ok=True)
-                            p.touch(exist_ok=True)
-                    dag_api.execute_workflow(executor="dryrun", updated_files=[])
-
-                # Expose the underlying workflow's dag via a simple wrapper
-                underlying_wf = wf_api._workflow
-                dag = getattr(underlying_wf, 'dag', None)
-                if dag is None:
-                    dag = getattr(getattr(underlying_wf, 'persistence', None), 'dag', None)
-                if dag is None:
-                    raise RuntimeError('Unable to access Snakemake DAG after dry-run execution')
-
-                # Store captured stderr for later use
-                self._stderr_output = stderr_capture.getvalue()
-                # Make DAG available to the class
-                self.dag = dag
-                return SimpleNamespace(dag=dag)
-        except Exception as e:
-            # Store stderr and exception for potential logging
-            self._stderr_output = stderr_capture.getvalue()
-            self._compilation_error = e
+            from ._codecache import _install as _install_code_cache
+            _install_code_cache()
 
-            # Try to extract DAG even if there was an error
-            if wf_api is not None:
-                try:
+        # Capture the stderr of this thread for potential logging, keeping its head and
+        # tail in memory. Other threads, e.g. a script running during a prefetch, keep theirs.
+        self.captured_stderr = StderrCapture(**self.stderr_capture_options)
+        with capture_thread_stderr(self.captured_stderr):
+            wf_api = None
+            try:
+                with _SMSnakemakeApi() as api:
+                    # Creating the DAG API parses and compiles the Snakefile
+                    with timer.phase('parse'):
+                        wf_api = api.workflow(
+                            resource_settings=_SMResourceSettings(cores=1),
+                            snakefile=Path(self.snakefile),
+                            workdir=None,
+                        )
+                        dag_api = wf_api.dag(
+                            dag_settings=_SMDAGSettings(
+                                targets=set(self.targets),
+                                forceall=True,
+                                force_incomplete=True
+                            )
+                        )
+                    # execute with dryrun executor to materialize DAG
+                    from snakemake.exceptions import MissingInputException
+
+                    try:
+                        with timer.phase('build_dag'):
+                            if self.pruned:
+                                self._build_pruned_dag(wf_api._workflow)
+                            elif self.virtual_inputs or self.stat_free:
+                                self._build_virtual_dag(wf_api._workflow)
+                            else:
+                                dag_api.execute_workflow(executor="dryrun", updated_files=[])
+                    except MissingInputException as ex:
+                        # Parse and create placeholder inputs if needed, then retry once.
+                        msg = str(ex)
+                        missing = []
+                        if "affected files:" in msg:
+                            tail = msg.split("affected files:")[-1].strip()
+                            for line in tail.splitlines():
+                                line = line.strip().lstrip("- ")
+                                if line:
+                                    missing.append(line)
+                        for m in missing:
+                            p = Path(m)
+                            if p.suffix == "":
+                                p.mkdir(parents=True, exist_ok=True)
+                            else:
+                                p.parent.mkdir(parents=True, exist_ok=True)
+                                p.touch(exist_ok=True)
+                        with timer.phase('missing_input_retry'):
+                            dag_api.execute_workflow(executor="dryrun", updated_files=[])
+
+                    # Expose the underlying workflow's dag via a simple wrapper
                     underlying_wf = wf_api._workflow
                     dag = getattr(underlying_wf, 'dag', None)
                     if dag is None:
                         dag = getattr(getattr(underlying_wf, 'persistence', None), 'dag', None)
-                    if dag is not None:
-                        self.dag = dag
-                except:
-                    pass  # If we can't get the DAG, that's ok
-            raise
-        finally:
-            # Restore original stderr
-            sys.stderr = old_stderr
+                    if dag is None:
+                        raise RuntimeError('Unable to access Snakemake DAG after dry-run execution')
+
+                    # Record the files the workflow was built from for cache invalidation
+                    self.source_files = [
+                        str(_path_or_uri(f)) for f in underlying_wf.included
+                    ] + [str(f) for f in underlying_wf.configfiles]
+
+                    # Make DAG available to the class
+                    self.dag = dag
+                    return SimpleNamespace(dag=dag)
+            except Exception as e:
+                # Store exception for potential logging
+                self._compilation_error = e
+                # The parser is never returned to the caller, so hand over the full text here
+                e.captured_stderr = self.captured_stderr
+
+                # Try to extract DAG even if there was an error
+                if wf_api is not None:
+                    try:
+                        underlying_wf = wf_api._workflow
+                        dag = getattr(underlying_wf, 'dag', None)
+                        if dag is None:
+                            dag = getattr(getattr(underlying_wf, 'persistence', None), 'dag', None)
+                        if dag is not None:
+                            self.dag = dag
+                    except:
+                        pass  # If we can't get the DAG, that's ok
+                raise
+
+    @staticmethod
+    def _prepare_dag(workflow):
+        """Set up an empty DAG for the targets without building or dry-running it."""
+        workflow._prepare_dag(forceall=True, ignore_incomplete=True,
+                              lock_warn_only=True, nolock=True)
+        return workflow.dag
+
+    def _build_pruned_dag(self, workflow):
+        """Create only the jobs producing the targets, skipping upstream jobs.
+
+        Input functions of these jobs are still evaluated, but their inputs are
+        not resolved to producing jobs, and no existence checks or dry-run take place.
+        """
+        dag = self._prepare_dag(workflow)
+        rules = [r for r in workflow.rules if self.rule is None or r.name == self.rule]
+        for target in self.targets:
+            for rule in rules:
+                if rule.is_producer(str(target)):
+                    job = _async_run(workflow, dag.new_job(rule, targetfile=str(target)))
+                    # Register the job so it is listed in dag.jobs like a regular DAG job
+                    dag._dependencies[job]
+                    dag.targetjobs.add(job)
+
+    def _build_virtual_dag(self, workflow):
+        """Build the full DAG for the targets in one pass without a dry-run.
+
+        Raw inputs that do not exist are treated as present in memory, so no
+        ``MissingInputException`` is raised and nothing is written to disk.
+        In ``stat_free`` mode their existence is not checked at all.
+        """
+        from ._iohooks import AssumeExisting, VirtualInputs, io_state
+
+        dag = self._prepare_dag(workflow)
+
+        async def build():
+            for file in dag.targetfiles:
+                job = await dag.update(await dag.file2jobs(file), file=file)
+                dag.targetjobs.add(job)
+            for rule in dag.targetrules:
+                job = await dag.update([await dag.rule2job(rule)])
+                dag.targetjobs.add(job)
+            dag.cleanup()
+
+        with io_state(AssumeExisting() if self.stat_free else VirtualInputs()) as state:
+            _async_run(workflow, build())
+        self.missing_inputs = state.missing
+
+    def close(self):
+        """Release the full stderr text captured while compiling, and its temporary file.
+
+        The head and tail stay available through ``captured_stderr.summary()``.
+        Caches call this when they drop the parser.
+        """
+        if self.captured_stderr is not None:
+            self.captured_stderr.close()
 
     def _extract_log_files(self):
         """Extract log file paths from all jobs in the DAG."""
+        dict(self.log_files)  # fills the lazy mapping in a single pass over the jobs
+
+    def iter_jobs(self, rule=None, wildcards=None, output=None):
+        """Yield the jobs of the DAG that match all given filters.
+
+        Jobs are tested one at a time as the DAG is walked, without building an
+        index, so finding a few jobs in a very large DAG is cheap in memory.
+
+        Args:
+        rule (str or collection): Rule name, or several rule names
+        wildcards (dict or callable): Wildcard values the job must have, or a predicate
+            called with the job's wildcards
+        output (str): Glob pattern (``fnmatch`` syntax) matched against each output path
+            of the job; the job is kept if any of them matches
+        """
+        from fnmatch import fnmatchcase
+
+        rules = {rule} if isinstance(rule, str) else None if rule is None else set(rule)
+        if isinstance(wildcards, dict):
+            expected = {name: str(value) for name, value in wildcards.items()}
+
+            def wildcards(wc):
+                return all(str(wc.get(name)) == value for name, value in expected.items())
+
         for job in self.dag.jobs:
-            if hasattr(job, 'log') and job.log:
-                # Get the first log file if there are multiple
-                if hasattr(job.log, '__iter__') and not isinstance(job.log, str):
-                    log_file = next(iter(job.log), None)
-                else:
-                    log_file = job.log
-                if log_file:
-                    self.log_files[job.name] = str(log_file)
+            if rules is not None and job.name not in rules:
+                continue
+            if wildcards is not None and not wildcards(job.wildcards):
+                continue
+            if output is not None and not any(fnmatchcase(os.path.normpath(str(f)), output)
+                                              for f in job.output):
+                continue
+            yield job
+
+    def _error_log_file(self, rulename, job=None):
+        """Log file for an error while resolving ``rulename``.
 
-    def _write_error_to_log(self, rulename: str, error: Exception):
-        """Write error information to the rule's log file."""
-        if rulename in self.log_files:
-            log_file = self.log_files[rulename]
+        That is the log of ``job``, or of the job ``getInputOutput4rule`` selects,
+        so that with several targets the error goes to the right job's log.
+        """
+        if job is None:
+            try:
+                job = self._select_job(rulename)
+            except Exception:
+                return self.log_files.get(rulename)  # e.g. no DAG after a failed compile
+        return _first_log_file(job)
+
+    def _write_error_to_log(self, rulename: str, error: Exception, job=None):
+        """Write error information to the log file of the rule's selected job."""
+        log_file = self._error_log_file(rulename, job)
+        if log_file is not None:
             import traceback
             log_path = Path(log_file)
             log_path.parent.mkdir(parents=True, exist_ok=True)
@@ -294,26 +808,47 @@ class IOParser:
                 f.write("=== Error during workflow compilation/execution ===\n")
                 f.write(f"Error: {str(error)}\n")
                 f.write(traceback.format_exc())
-                if hasattr(self, '_stderr_output') and self._stderr_output:
+                capture = getattr(self, 'captured_stderr', None)
+                if capture is not None and capture.size:
                     f.write("\n=== Captured stderr ===\n")
-                    f.write(self._stderr_output)
+                    f.write(capture.summary())
                 f.write("\n")
 
+    @property
+    def _stderr_output(self):
+        """Head and tail of the stderr captured while compiling (see ``StderrCapture``)."""
+        capture = getattr(self, 'captured_stderr', None)
+        return capture.summary() if capture is not None else ''
+
+    @property
+    def job_index(self):
+        """``JobIndex`` over the jobs of the DAG, built on first use."""
+        if self._job_index is None:
+            self._job_index = JobIndex(self.dag.jobs)
+        return self._job_index
+
     def getInputOutput(self):
+        # Materialises one job per rule; use iter_jobs to query large DAGs
         return self.getJobList(self.dag)
 
-    def getInputOutput4rule(self, rulename: str):
+    def getInputOutput4rule(self, rulename: str, wildcards: dict = None):
         """Get the input and output of a specific rule.
 
+        When the rule has several jobs in the DAG, the job with the given
+        ``wildcards`` is returned. Without ``wildcards``, the job producing one
+        of the targets is preferred, otherwise the last job of the rule.
+
         If an error occurred during compilation, log it to the rule's log file.
         """
         try:
-            io = self.getInputOutput()
-            result = io[rulename]
+            if wildcards is not None:
+                result = self.job_index.get(rulename, **wildcards)
+            else:
+                result = self._select_job(rulename)
 
             # If there was a compilation error stored, write it to log
             if hasattr(self, '_compilation_error'):
-                self._write_error_to_log(rulename, self._compilation_error)
+                self._write_error_to_log(rulename, self._compilation_error, result)
 
             return result
         except Exception as e:
@@ -321,40 +856,285 @@ class IOParser:
             self._write_error_to_log(rulename, e)
             raise
 
+    def _select_job(self, rulename):
+        # Streams the jobs of the rule instead of indexing the whole DAG. The job
+        # producing the earliest target wins, otherwise the rule's last job.
+        targets = {}
+        for position, target in enumerate(self.targets):
+            targets.setdefault(os.path.normpath(str(target)), position)
+        best, best_position, last = None, len(targets), None
+        for job in self.iter_jobs(rule=rulename):
+            last = job
+            for f in job.output:
+                position = targets.get(os.path.normpath(str(f)), best_position)
+                if position < best_position:
+                    best, best_position = job, position
+            if best_position == 0:
+                break
+        if last is None:
+            raise KeyError(rulename)
+        return best if best is not None else last
+
     def getJobList(self, dag):
-        # Return a dict of jobs
-        jobs = {}
-        for j in dag.jobs:
-            jobs[j.name] = j
-        return jobs
+        # Return a dict of jobs, one per rule (the last job when a rule has several)
+        index = self.job_index if dag is self.dag else JobIndex(dag.jobs)
+        return {rule: jobs[-1] for rule, jobs in index.by_rule.items()}
+
+
+def _first_log_file(job):
+    log = getattr(job, 'log', None)
+    if not log:
+        return None
+    # Get the first log file if there are multiple
+    if hasattr(log, '__iter__') and not isinstance(log, str):
+        log = next(iter(log), None)
+    return str(log) if log else None
+
+
+class _LazyLogFiles(Mapping):
+    """Rule name -> log file of the rule's last job, looked up on first access.
+
+    Only the jobs of the queried rule are inspected. Iterating over the
+    mapping inspects all jobs once.
+    """
+
+    def __init__(self, parser):
+        self._parser = parser
+        self._found = {}  # rule -> log file, or None if the rule has no log
+        self._complete = False
+
+    def __getitem__(self, rule):
+        if rule not in self._found and not self._complete and self._parser.dag is not None:
+            log_file = None
+            for job in self._parser.iter_jobs(rule=rule):
+                log_file = _first_log_file(job) or log_file
+            self._found[rule] = log_file
+        log_file = self._found.get(rule)
+        if log_file is None:
+            raise KeyError(rule)
+        return log_file
+
+    def _complete_all(self):
+        if not self._complete and self._parser.dag is not None:
+            found = {}
+            for job in self._parser.iter_jobs():
+                log_file = _first_log_file(job)
+                if log_file:
+                    found[job.name] = log_file
+            self._found = found
+            self._complete = True
+        return self._found
+
+    def __iter__(self):
+        return iter([rule for rule, log_file in self._complete_all().items() if log_file])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+class JobIndex:
+    """Index of DAG jobs by rule name, wildcard values and output path.
+
+    Built once per DAG; all lookups are dictionary lookups so large DAGs can
+    be queried repeatedly without rescanning ``dag.jobs``.
+    """
+
+    def __init__(self, jobs):
+        self.by_rule = {}  # rule -> [job, ...]
+        self.by_wildcards = {}  # (rule, wildcards_key) -> job
+        self.by_wildcard_value = {}  # (rule, name, value) -> [job, ...]
+        self.by_output = {}  # normalised output path -> job
+        for job in jobs:
+            self.add(job)
+
+    def add(self, job):
+        from .resolved import wildcards_key
+
+        self.by_rule.setdefault(job.name, []).append(job)
+        self.by_wildcards[(job.name, wildcards_key(job.wildcards))] = job
+        for name, value in job.wildcards.items():
+            self.by_wildcard_value.setdefault((job.name, name, str(value)), []).append(job)
+        for f in job.output:
+            self.by_output[os.path.normpath(str(f))] = job
+
+    def __len__(self):
+        return len(self.by_wildcards)
+
+    def jobs_for_rule(self, rule):
+        """Return all jobs of a rule (empty list if the rule has none)."""
+        return self.by_rule.get(rule, [])
+
+    def get(self, rule, **wildcards):
+        """Return the job of ``rule`` with exactly these wildcard values.
+
+        Raises:
+            KeyError: If no such job exists.
+        """
+        from .resolved import wildcards_key
+
+        key = wildcards_key(wildcards)
+        try:
+            return self.by_wildcards[(rule, key)]
+        except KeyError:
+            raise KeyError(f'No job of rule {rule!r} with wildcards {dict(key)}') from None
+
+    def find(self, rule, **wildcards):
+        """Return all jobs of ``rule`` whose wildcards include the given values."""
+        if not wildcards:
+            return list(self.jobs_for_rule(rule))
+        candidates = None
+        for name, value in wildcards.items():
+            jobs = self.by_wildcard_value.get((rule, name, str(value)), [])
+            if candidates is None:
+                candidates = jobs
+            else:
+                matching = set(jobs)
+                candidates = [j for j in candidates if j in matching]
+        return list(candidates)
+
+    def producer(self, path):
+        """Return the job producing ``path``, or None."""
+        return self.by_output.get(os.path.normpath(str(path)))
 
 
 # Redirect stderr to logger
 class StreamToLogger:
-    """Redirect stream writes to logger at ERROR level."""
+    """Redirect stream writes to logger at ERROR level.
+
+    Each line written becomes one log record. Records are handed to a
+    background thread through a bounded queue, so writers never block on
+    the log file. When the queue is full new records are dropped and a
+    warning with the number of dropped records is logged once there is room.
+    Partial lines are kept until their newline arrives, ``close()`` is called
+    or the interpreter exits; a carriage return discards the text before it,
+    as a terminal would for progress bars.
+
+    In a forked child process the background thread does not exist, so the
+    child logs its records directly instead.
+    """
 
-    def __init__(self, logger_instance, original_stderr=None):
+    _SENTINEL = object()
+
+    def __init__(self, logger_instance, original_stderr=None, max_queue=10000,
+                 max_line_length=65536):
         """Initialize StreamToLogger with a logger instance.
 
         Args:
             logger_instance: A logger object with an error() method (e.g., loguru logger)
             original_stderr: The original stderr stream to use for terminal output (optional)
+            max_queue: Maximum number of records waiting to be written
+            max_line_length: Partial lines longer than this are emitted as a record
         """
+        import atexit
+        import queue
+        import threading
+
         self.logger = logger_instance
-        self._buffer = ''
         self._original_stderr = original_stderr or sys.__stderr__
+        self.max_line_length = max_line_length
+        self._pending = []  # fragments of the current, unterminated line
+        self._pending_len = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._closed = False
+        self._pid = os.getpid()
+        self._direct = False
+        self._thread = threading.Thread(target=self._run, name='snakehelper-log', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
 
     def write(self, message: str) -> None:
-        if not message:
+        if not message or self._closed:
             return
+        if os.getpid() != self._pid:
+            self._after_fork()
+
+        with self._lock:
+            message = message.replace('\r\n', '\n')
+            if '\r' in message:
+                # Keep only what a terminal would still show of the line
+                head, _, message = message.rpartition('\r')
+                if '\n' in head:
+                    self._write_lines(head[:head.rindex('\n') + 1])
+                self._pending, self._pending_len = [], 0
+            self._write_lines(message)
+
+    def _write_lines(self, message):
+        lines = message.split('\n')
+        if len(lines) > 1:
+            self._pending.append(lines[0])
+            self._emit(''.join(self._pending))
+            for line in lines[1:-1]:
+                self._emit(line)
+            self._pending, self._pending_len = [], 0
+        if lines[-1]:
+            self._pending.append(lines[-1])
+            self._pending_len += len(lines[-1])
+            if self._pending_len > self.max_line_length:
+                self._emit(''.join(self._pending))
+                self._pending, self._pending_len = [], 0
+
+    def _after_fork(self):
+        import threading
+
+        self._pid = os.getpid()
+        self._lock = threading.Lock()  # the parent may have held it while forking
+        self._pending, self._pending_len = [], 0
+        self._direct = True
 
-        self._buffer += message
-        if message.endswith("\n"):
-            text = self._buffer.strip()
-            if text:
-                # Log the entire accumulated message once
+    def _emit(self, text):
+        import queue
+
+        text = text.strip()
+        if text and self._direct:
+            try:
                 self.logger.error(text)
-            self._buffer = ""
+            except Exception:
+                pass
+        elif text:
+            try:
+                self._queue.put_nowait(text)
+            except queue.Full:
+                self.dropped += 1
+
+    def _run(self):
+        reported = 0
+        while True:
+            item = self._queue.get()
+            try:
+                if item is self._SENTINEL:
+                    return
+                try:
+                    self.logger.error(item)
+                except Exception:
+                    pass  # a failing sink must not stop logging of later records
+                if self.dropped > reported and self._queue.empty():
+                    self.logger.warning(f'{self.dropped - reported} stderr messages were dropped '
+                                        'because the log queue was full')
+                    reported = self.dropped
+            finally:
+                self._queue.task_done()
 
     def flush(self) -> None:
-        pass
\ No newline at end of file
+        """Wait until all complete lines written so far have been logged."""
+        if not self._direct and self._thread.is_alive():
+            self._queue.join()
+
+    def close(self) -> None:
+        """Log any partial line, write out the queue and stop the background thread."""
+        with self._lock:
+            if self._closed:
+                return
+            if self._pending:
+                self._emit(''.join(self._pending))
+                self._pending, self._pending_len = [], 0
+            self._closed = True
+        if not self._direct and self._thread.is_alive():
+            self._queue.put(self._SENTINEL)
+            self._thread.join()
+        import atexit
+        atexit.unregister(self.close)
+
+    def isatty(self) -> bool:
+        return False
@@ -0,0 +1,4 @@
+def main(argv=None):
+    """Entry point of the ``snakehelper`` console script."""
+    from .cli import main as _main
+    return _main(argv)
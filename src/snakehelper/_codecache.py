@@ -0,0 +1,180 @@
+"""Cache of the Python code Snakemake translates each Snakefile into.
+
+``Workflow.include`` translates every Snakefile and included file with
+``snakemake.parser.parse`` and then ``compile()``s the result, on every
+compile of the workflow and regardless of the targets. The overrides
+installed here into the ``snakemake.workflow`` module keep the translated
+source, the line map and the code object of each file, keyed by its
+content, like ``.pyc`` files do for modules. A workflow whose files did not
+change therefore skips translation and compilation, even for new targets.
+
+Entries are kept in memory and, as marshal files, in ``$SNAKEHELPER_CODE_CACHE``
+(default ``~/.cache/snakehelper/code``). Set it to ``0`` to disable the cache.
+At most ``MAX_ENTRIES`` files are kept in memory, least recently used first out.
+"""
+
+import builtins
+import hashlib
+import importlib.util
+import marshal
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+CODE_CACHE_ENV = 'SNAKEHELPER_CODE_CACHE'
+MAX_ENTRIES = 256
+
+_lock = threading.Lock()
+_installed = False
+_entries = OrderedDict()  # key -> (code text, rulecount, linemap)
+_compiled = OrderedDict()  # code text -> (filename, code object)
+_pending = OrderedDict()  # code text -> key, for translations not yet compiled
+_stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+
+def get_code_cache_dir():
+    """Return the directory of the on-disk code cache, or None if it is disabled."""
+    value = os.environ.get(CODE_CACHE_ENV)
+    if value == '0':
+        return None
+    if value:
+        return Path(value)
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return Path(base, 'snakehelper', 'code')
+
+
+def _enabled():
+    return os.environ.get(CODE_CACHE_ENV) != '0'
+
+
+def stats():
+    """Return the number of memory hits, disk hits and misses since the start."""
+    return dict(_stats)
+
+
+def clear():
+    """Forget the entries kept in memory; files on disk are kept."""
+    with _lock:
+        _entries.clear()
+        _compiled.clear()
+        _pending.clear()
+
+
+def _remember(entries, key, value):
+    """Store ``value``, evicting the least recently used entries beyond ``MAX_ENTRIES``."""
+    entries[key] = value
+    entries.move_to_end(key)
+    while len(entries) > MAX_ENTRIES:
+        entries.popitem(last=False)
+
+
+def _key(source_path, content, rulecount, overwrite_shellcmd):
+    import snakemake
+
+    h = hashlib.blake2b(digest_size=20)
+    for part in (snakemake.__version__, importlib.util.MAGIC_NUMBER.hex(), source_path,
+                 str(rulecount), repr(overwrite_shellcmd)):
+        h.update(part.encode() + b'\0')
+    h.update(content)
+    return h.hexdigest()
+
+
+def _load(key):
+    cache_dir = get_code_cache_dir()
+    if cache_dir is None:
+        return None
+    try:
+        with open(cache_dir / key[:2] / (key + '.marshal'), 'rb') as f:
+            code, rulecount, linemap, filename, code_object = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None  # missing, or written by an incompatible version
+    _remember(_compiled, code, (filename, code_object))
+    return code, rulecount, linemap
+
+
+def _store(key, entry, filename, code_object):
+    cache_dir = get_code_cache_dir()
+    if cache_dir is None:
+        return
+    path = cache_dir / key[:2] / (key + '.marshal')
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump((*entry, filename, code_object), f)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+    except OSError:
+        pass  # the cache is an optimisation; a read-only location must not break compiles
+
+
+def _install():
+    global _installed
+    if _installed:
+        return
+    import snakemake.workflow as sm_workflow
+    from snakemake.sourcecache import LocalSourceFile
+
+    from .SnakeIOHelper import _path_or_uri
+
+    original_parse = sm_workflow.parse
+
+    def parse(path, workflow, linemap, overwrite_shellcmd=None, rulecount=0):
+        if not _enabled() or not isinstance(path, LocalSourceFile):
+            return original_parse(path, workflow, linemap=linemap,
+                                  overwrite_shellcmd=overwrite_shellcmd, rulecount=rulecount)
+        source_path = _path_or_uri(path)
+        with open(_path_or_uri(path, secret_free=False), 'rb') as f:
+            content = f.read()
+        key = _key(source_path, content, rulecount, overwrite_shellcmd)
+        with _lock:
+            entry = _entries.get(key)
+            if entry is not None:
+                _stats['memory_hits'] += 1
+                _entries.move_to_end(key)
+            else:
+                entry = _load(key)
+                if entry is not None:
+                    _stats['disk_hits'] += 1
+                    _remember(_entries, key, entry)
+        if entry is None:
+            code, new_rulecount = original_parse(path, workflow, linemap=linemap,
+                                                 overwrite_shellcmd=overwrite_shellcmd,
+                                                 rulecount=rulecount)
+            with _lock:
+                _stats['misses'] += 1
+                _remember(_entries, key, (code, new_rulecount, dict(linemap)))
+                _remember(_pending, code, key)
+            return code, new_rulecount
+        code, new_rulecount, cached_linemap = entry
+        linemap.update(cached_linemap)
+        return code, new_rulecount
+
+    def compile(source, filename, mode, *args, **kwargs):
+        if isinstance(source, str) and mode == 'exec' and not args and not kwargs:
+            with _lock:
+                compiled = _compiled.get(source)
+                if compiled is not None:
+                    _compiled.move_to_end(source)
+                key = _pending.pop(source, None)
+            if compiled is not None and compiled[0] == filename:
+                return compiled[1]
+            code_object = builtins.compile(source, filename, mode)
+            if key is not None:
+                with _lock:
+                    _remember(_compiled, source, (filename, code_object))
+                    entry = _entries.get(key)
+                if entry is not None:
+                    _store(key, entry, filename, code_object)
+            return code_object
+        return builtins.compile(source, filename, mode, *args, **kwargs)
+
+    # Only ``Workflow.include`` looks these names up in the module globals
+    sm_workflow.parse = parse
+    sm_workflow.compile = compile
+    _installed = True
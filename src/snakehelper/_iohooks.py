@@ -0,0 +1,70 @@
+"""Scoped overrides of Snakemake's file existence checks.
+
+Snakemake asks ``_IOFile.exists`` whether each input without a producing job
+is present on disk, and raises ``MissingInputException`` if it is not. The
+hook installed here lets ``IOParser`` answer that question itself for the
+duration of a DAG build in the current context (thread or task), without
+affecting other threads. ``AssumeExisting`` answers without touching the
+filesystem at all, which matters on filesystems with slow metadata calls.
+"""
+
+import contextvars
+from contextlib import contextmanager
+
+_state = contextvars.ContextVar('snakehelper_io_state', default=None)
+_installed = False
+
+
+class VirtualInputs:
+    """Treat missing files as present and record which ones they were."""
+
+    def __init__(self):
+        self.missing = set()
+
+    async def exists(self, iofile, original):
+        if await original(iofile):
+            return True
+        self.missing.add(str(iofile))
+        return True
+
+
+class AssumeExisting:
+    """Treat every file as present without asking the filesystem at all.
+
+    Missing files are not detected, so ``missing`` stays empty.
+    """
+
+    def __init__(self):
+        self.missing = set()
+
+    async def exists(self, iofile, original):
+        return True
+
+
+def _install():
+    global _installed
+    if _installed:
+        return
+    from snakemake.io import _IOFile
+
+    original = _IOFile.exists
+
+    async def exists(self):
+        state = _state.get()
+        if state is None:
+            return await original(self)
+        return await state.exists(self, original)
+
+    _IOFile.exists = exists
+    _installed = True
+
+
+@contextmanager
+def io_state(state):
+    """Route existence checks through ``state`` within this context."""
+    _install()
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
@@ -0,0 +1,63 @@
+"""Resolve the I/O of many targets and rules from a single workflow compile."""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _resolve_chunk(snakefile, targets, rules, parser_options, cwd=None):
+    from .SnakeIOHelper import IOParser
+    from .resolved import ResolvedIO
+
+    if cwd is not None:
+        os.chdir(cwd)
+    parser = IOParser(snakefile, targets, **parser_options)
+    return {
+        key: ResolvedIO.from_job(job)
+        for key, job in parser.job_index.by_wildcards.items()
+        if rules is None or key[0] in rules
+    }
+
+
+def resolve_many(snakefile, targets, rules=None, processes=None, chunk_size=None,
+                 pruned=False, virtual_inputs=False, stat_free=False):
+    """Resolve the I/O of all jobs needed for many targets at once.
+
+    The workflow is compiled and its DAG built once for all targets, instead of
+    once per target as with repeated ``getSnake`` calls. With ``processes`` the
+    targets are split into chunks that are resolved in parallel worker processes.
+
+    Args:
+        snakefile (str): Snakefile location
+        targets (list): Target files
+        rules (list): Only return jobs of these rules. Default is all jobs in the DAG.
+        processes (int): Number of worker processes. Default is to resolve in this process.
+        chunk_size (int): Targets per worker task. Default spreads the targets evenly
+            over the workers.
+        pruned (bool): Only build the jobs that produce the targets (see ``IOParser``).
+        virtual_inputs (bool): Treat missing raw inputs as present (see ``IOParser``).
+        stat_free (bool): Build the DAG without filesystem metadata calls (see ``IOParser``).
+
+    Returns:
+        dict: Maps ``(rule, wildcards)`` to a ``ResolvedIO`` record, where ``wildcards``
+        is a sorted tuple of ``(name, value)`` pairs.
+    """
+    targets = [str(t) for t in targets]
+    rules = None if rules is None else set(rules)
+    parser_options = {'pruned': pruned, 'virtual_inputs': virtual_inputs, 'stat_free': stat_free}
+    if pruned and rules is not None and len(rules) == 1:
+        parser_options['rule'] = next(iter(rules))
+    if not processes or processes <= 1 or len(targets) <= 1:
+        return _resolve_chunk(snakefile, targets, rules, parser_options)
+
+    if chunk_size is None:
+        chunk_size = -(-len(targets) // processes)
+    chunks = [targets[i:i + chunk_size] for i in range(0, len(targets), chunk_size)]
+    snakefile = os.path.abspath(snakefile)
+    results = {}
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(_resolve_chunk, snakefile, chunk, rules, parser_options,
+                               os.getcwd())
+                   for chunk in chunks]
+        for future in futures:
+            results.update(future.result())
+    return results
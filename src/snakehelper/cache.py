@@ -0,0 +1,431 @@
+"""Caching of resolved rule I/O so repeated lookups can skip Snakemake.
+
+Two caches live here: ``ResultCache`` persists resolved I/O on disk across
+processes, and ``parser_cache`` keeps compiled ``IOParser`` objects in memory
+for long-lived processes such as Jupyter kernels.
+
+A disk cache entry is keyed by the content of the Snakefile, the targets, the
+rule and the working directory. Each entry also records the hashes of all
+files the workflow was built from (included Snakefiles, config files), so
+editing any of them invalidates the entry automatically.
+
+The disk cache may live on a filesystem shared by many nodes. Entries are
+written to a temporary file and renamed into place. A process that misses
+takes a per-key lock file first (``KeyLock``), so that when many processes
+miss on the same key only one compiles the workflow and the others wait for
+its entry. Lock files of crashed processes are detected and removed. If the
+owner fails to compute the entry, it leaves a failure marker naming its lock,
+and the processes that waited on that lock raise ``ResolutionFailed`` instead
+of each repeating the failing compile.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+CACHE_DIR_ENV = 'SNAKEHELPER_CACHE_DIR'
+PARSER_CACHE_SIZE_ENV = 'SNAKEHELPER_PARSER_CACHE_SIZE'
+
+# Bump whenever the layout of a cache entry changes
+_CACHE_VERSION = 2
+
+
+def hash_file(path):
+    """Return the sha256 hex digest of a file's content, or None if it is missing."""
+    h = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def get_cache_dir(cache_dir=None):
+    """Return the cache directory to use, falling back to ``$SNAKEHELPER_CACHE_DIR``."""
+    if cache_dir is None:
+        cache_dir = os.environ.get(CACHE_DIR_ENV)
+    return None if cache_dir is None else Path(cache_dir)
+
+
+class ResolutionFailed(RuntimeError):
+    """The process computing a cache entry that this process waited for failed."""
+
+
+class KeyLock:
+    """Advisory lock file of one cache key, held while its entry is computed.
+
+    The lock file is created with ``O_CREAT | O_EXCL`` and records the host and
+    pid of its owner. While held, its mtime is refreshed every ``stale_after / 4``
+    seconds. A lock is stale when its owner is a dead process on this host or
+    its mtime is older than ``stale_after`` seconds, e.g. because its owner's
+    node crashed.
+
+    A lock file is only ever removed after checking that it is still the one
+    that was judged stale, or for ``release``, the one this process created.
+    """
+
+    def __init__(self, path, stale_after=300.0):
+        self.path = Path(path)
+        self.stale_after = stale_after
+        self._content = None
+        self._stop = None
+
+    def try_acquire(self):
+        """Create the lock file; return False if another process holds the lock."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        content = json.dumps({'host': socket.gethostname(), 'pid': os.getpid(),
+                              'time': time.time(), 'id': uuid.uuid4().hex}).encode()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        self._content = content
+        self._stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(self._stop,), daemon=True,
+                         name='snakehelper-cache-lock').start()
+        return True
+
+    def _heartbeat(self, stop):
+        while not stop.wait(self.stale_after / 4):
+            try:
+                os.utime(self.path)
+            except OSError:
+                pass  # briefly renamed by a process checking whether it is stale
+
+    def stale_state(self):
+        """Return the content and mtime of the lock file if it is stale, else None.
+
+        Pass the result to ``break_stale``.
+        """
+        try:
+            st = self.path.stat()
+            with open(self.path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            return None
+        age = time.time() - st.st_mtime
+        state = (content, st.st_mtime_ns)
+        try:
+            owner = json.loads(content)
+        except ValueError:
+            # Half-written lock files are only stale once old
+            return state if age > self.stale_after else None
+        if isinstance(owner, dict) and owner.get('host') == socket.gethostname():
+            try:
+                os.kill(owner['pid'], 0)
+            except ProcessLookupError:
+                return state
+            except (OSError, KeyError, TypeError):
+                pass
+        return state if age > self.stale_after else None
+
+    @property
+    def id(self):
+        """Unique id of the lock this object holds, or None."""
+        return None if self._content is None else json.loads(self._content)['id']
+
+    def owner_id(self):
+        """Return the unique id of the lock currently held by any process, or None."""
+        try:
+            owner = json.loads(self.path.read_bytes())
+            return owner['id']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def break_stale(self, state):
+        """Remove the lock file if it still is the one ``stale_state`` returned ``state`` for."""
+        content, mtime_ns = state
+        self._remove_if(content, mtime_ns)
+
+    def release(self):
+        """Stop refreshing the lock and remove the lock file if it is still ours."""
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+        if self._content is not None:
+            self._remove_if(self._content)
+            self._content = None
+
+    def _remove_if(self, content, mtime_ns=None):
+        """Remove the lock file if it holds ``content`` (and has ``mtime_ns``).
+
+        The file is first renamed to a unique name, so that no two processes
+        check and remove the same file. This is not exclusive: while the file
+        is renamed away, another process may take a fresh lock. A lock file
+        that turns out to be a different one is then not put back, and two
+        processes may compute the same entry; ``put`` is atomic, so the
+        entry stays consistent and only the compile is duplicated.
+        """
+        graveyard = self.path.with_name(f'{self.path.name}.stale-{uuid.uuid4().hex}')
+        try:
+            os.rename(self.path, graveyard)
+        except FileNotFoundError:
+            return False
+        try:
+            matches = graveyard.read_bytes() == content and \
+                (mtime_ns is None or graveyard.stat().st_mtime_ns == mtime_ns)
+        except OSError:
+            matches = False
+        if not matches:
+            try:
+                os.link(graveyard, self.path)
+            except OSError:
+                pass
+        graveyard.unlink(missing_ok=True)
+        return matches
+
+
+class ResultCache:
+    """Persistent on-disk cache of resolved rule I/O.
+
+    Args:
+        cache_dir (str): Directory of the cache, possibly on a shared filesystem
+        stale_after (float): Seconds after which a lock file that is no longer
+            refreshed is considered abandoned (see ``KeyLock``)
+    """
+
+    def __init__(self, cache_dir, stale_after=300.0):
+        self.cache_dir = Path(cache_dir)
+        self.stale_after = stale_after
+
+    def key(self, snakefile, targets, rule):
+        """Compute the cache key for a lookup."""
+        payload = json.dumps([
+            _CACHE_VERSION,
+            os.path.abspath(snakefile),
+            hash_file(snakefile),
+            [str(t) for t in targets],
+            rule,
+            os.getcwd(),
+        ])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / (key + '.pkl')
+
+    def _write(self, path, entry):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+    def get(self, snakefile, targets, rule):
+        """Return the cached ``ResolvedIO`` or None on a miss or a stale entry."""
+        return self._get(self.key(snakefile, targets, rule))
+
+    def _get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, TypeError):
+            return None  # unreadable, or written by an incompatible version
+        if entry.get('version') != _CACHE_VERSION:
+            return None
+        for dep, digest in entry['deps'].items():
+            if hash_file(dep) != digest:
+                return None
+        return entry['record']
+
+    def put(self, snakefile, targets, rule, record, sources=()):
+        """Store a ``ResolvedIO`` along with the hashes of the files it depends on.
+
+        The entry is written to a temporary file and renamed into place so
+        that concurrent readers never see a partial entry.
+        """
+        deps = {os.path.abspath(p): hash_file(p) for p in [snakefile, *sources]}
+        entry = {'version': _CACHE_VERSION, 'deps': deps, 'record': record}
+        self._write(self._path(self.key(snakefile, targets, rule)), entry)
+
+    def put_failure(self, snakefile, targets, rule, lock, error):
+        """Record that computing an entry under ``lock`` failed with ``error``.
+
+        Processes that waited on ``lock`` then raise ``ResolutionFailed`` with
+        the error message, instead of taking the lock in turn and failing again.
+        Call this before ``lock.release()``.
+        """
+        entry = {'version': _CACHE_VERSION, 'lock': lock.id,
+                 'error': f'{type(error).__name__}: {error}'}
+        key = self.key(snakefile, targets, rule)
+        self._write(self._path(key).with_suffix('.failed'), entry)
+
+    def _failure(self, key, owners):
+        """Return the error recorded under one of the lock ids ``owners``, or None."""
+        if not owners:
+            return None
+        try:
+            with open(self._path(key).with_suffix('.failed'), 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, TypeError):
+            return None
+        if entry.get('version') != _CACHE_VERSION or entry.get('lock') not in owners:
+            return None
+        return entry['error']
+
+    def acquire(self, snakefile, targets, rule, wait_timeout=600.0, poll_interval=0.2):
+        """Take the lock of a key before computing its entry (single-flight).
+
+        If another process holds the lock, wait until it stores the entry or
+        the lock is released or found stale.
+
+        Returns:
+            tuple: ``(record, None)`` if the entry became available while waiting,
+            ``(None, lock)`` if this process must compute the entry, ``put`` it (or
+            ``put_failure`` if that fails) and then ``lock.release()``, or
+            ``(None, None)`` if ``wait_timeout`` seconds passed without the entry
+            appearing.
+
+        Raises:
+            ResolutionFailed: If a process whose lock this one waited on failed
+                to compute the entry.
+        """
+        key = self.key(snakefile, targets, rule)
+        lock = KeyLock(self._path(key).with_suffix('.lock'), self.stale_after)
+        deadline = time.monotonic() + wait_timeout
+        owners = set()  # ids of the locks waited on
+        while True:
+            if lock.try_acquire():
+                # The entry may have been stored between our miss and taking the lock
+                record = self._get(key)
+                if record is not None:
+                    lock.release()
+                    return record, None
+                error = self._failure(key, owners)
+                if error is not None:
+                    lock.release()
+                    raise ResolutionFailed(error)
+                return None, lock
+            owner = lock.owner_id()
+            if owner is not None:
+                owners.add(owner)
+            state = lock.stale_state()
+            if state is not None:
+                lock.break_stale(state)
+                continue
+            if self._path(key).exists():
+                record = self._get(key)
+                if record is not None:
+                    return record, None
+            error = self._failure(key, owners)
+            if error is not None:
+                raise ResolutionFailed(error)
+            if time.monotonic() > deadline:
+                return None, None
+            time.sleep(poll_interval)
+
+    def clear(self):
+        """Remove all cache entries and failure markers."""
+        for pattern in ('*/*.pkl', '*/*.failed'):
+            for p in self.cache_dir.glob(pattern):
+                p.unlink(missing_ok=True)
+
+
+def _fingerprint(paths):
+    """Cheap change detector for a set of files based on ``stat``."""
+    fp = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+            fp.append((p, st.st_mtime_ns, st.st_size))
+        except OSError:
+            fp.append((p, None, None))
+    return tuple(fp)
+
+
+def _release(parser):
+    """Let a dropped parser free the stderr text it captured (see ``IOParser.close``)."""
+    close = getattr(parser, 'close', None)
+    if close is not None:
+        close()
+
+
+class ParserCache:
+    """Size-bounded, thread-safe LRU cache of compiled ``IOParser`` objects.
+
+    Entries are keyed by the Snakefile path, the targets, the working
+    directory and any ``options`` the parser was built with. Each entry remembers the mtime and size of the Snakefile and
+    the files it includes, and is dropped on lookup if any of them changed.
+    """
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, snakefile, targets, options=()):
+        return (os.path.abspath(snakefile), tuple(str(t) for t in targets), os.getcwd(),
+                tuple(options))
+
+    def get(self, snakefile, targets, options=()):
+        """Return the cached parser, or None on a miss or when its sources changed."""
+        key = self.key(snakefile, targets, options)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                parser, fp = entry
+                if _fingerprint([p for p, _, _ in fp]) == fp:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return parser
+                del self._entries[key]
+                _release(parser)
+            self.misses += 1
+            return None
+
+    def put(self, snakefile, targets, parser, options=()):
+        """Store a parser, evicting the least recently used entries beyond ``maxsize``."""
+        if self.maxsize <= 0:
+            return
+        sources = [os.path.abspath(p) for p in [snakefile, *parser.source_files]]
+        key = self.key(snakefile, targets, options)
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None and old[0] is not parser:
+                _release(old[0])
+            self._entries[key] = (parser, _fingerprint(dict.fromkeys(sources)))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                _release(self._entries.popitem(last=False)[1][0])
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            for parser, _fp in self._entries.values():
+                _release(parser)
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Return hit/miss/eviction counters and the current size as a dict."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+parser_cache = ParserCache(maxsize=int(os.environ.get(PARSER_CACHE_SIZE_ENV, 16)))
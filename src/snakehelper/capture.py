@@ -0,0 +1,195 @@
+"""Bounded capture of the text Snakemake writes to stderr during a compile.
+
+A dry-run of a large workflow can print a lot of text. ``StderrCapture``
+keeps it in memory up to a threshold and spills the rest to a temporary
+file, while always keeping the first and last part of the text in memory.
+Error logs then contain only that head and tail, and the full text stays
+available through ``iter_text``.
+
+``capture_thread_stderr`` collects only what the calling thread writes to
+``sys.stderr``, so a compile on a background thread (a prefetch or the
+workflow watcher) leaves the stderr of the other threads alone.
+"""
+
+import collections
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+class StderrCapture:
+    """File-like object that captures text with bounded memory use.
+
+    Args:
+        head_size (int): Number of leading characters always kept in memory
+        tail_size (int): Number of trailing characters always kept in memory
+        spill_threshold (int): Beyond this many characters the full text is moved
+            to a temporary file. With None the full text is not kept beyond the head
+            and tail.
+    """
+
+    def __init__(self, head_size=32 * 1024, tail_size=32 * 1024, spill_threshold=256 * 1024):
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.spill_threshold = spill_threshold
+        self.size = 0
+        self._head = []
+        self._head_len = 0
+        self._tail = collections.deque()
+        self._tail_len = 0
+        self._full = []  # complete text while it is below spill_threshold
+        self._spill = None
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        if not text:
+            return 0
+        with self._lock:
+            self.size += len(text)
+            if self._head_len < self.head_size:
+                part = text[:self.head_size - self._head_len]
+                self._head.append(part)
+                self._head_len += len(part)
+            self._add_to_tail(text)
+            self._add_to_full(text)
+        return len(text)
+
+    def _add_to_tail(self, text):
+        if len(text) >= self.tail_size:
+            self._tail.clear()
+            text = text[len(text) - self.tail_size:]
+            self._tail_len = 0
+        self._tail.append(text)
+        self._tail_len += len(text)
+        while self._tail_len - len(self._tail[0]) >= self.tail_size:
+            self._tail_len -= len(self._tail.popleft())
+
+    def _add_to_full(self, text):
+        if self._spill is not None:
+            self._spill.write(text)
+        elif self.spill_threshold is None:
+            pass
+        elif self.size <= self.spill_threshold:
+            self._full.append(text)
+        else:
+            self._spill = tempfile.TemporaryFile('w+', encoding='utf-8',
+                                                 prefix='snakehelper-stderr-')
+            self._spill.writelines(self._full)
+            self._spill.write(text)
+            self._full = []
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def writable(self):
+        return True
+
+    @property
+    def spilled(self):
+        """Whether the full text was moved to a temporary file."""
+        return self._spill is not None
+
+    @property
+    def truncated(self):
+        """Whether ``summary()`` leaves out part of the text."""
+        return self.size > self.head_size + self.tail_size
+
+    def summary(self):
+        """Return the head and tail of the text, with a marker for the omitted middle."""
+        with self._lock:
+            head = ''.join(self._head)
+            tail = ''.join(self._tail)
+            rest = self.size - len(head)
+            if not self.truncated:
+                return head + (tail[-rest:] if rest else '')
+            tail = tail[-self.tail_size:]
+            return f'{head}\n... [{rest - len(tail)} characters omitted] ...\n{tail}'
+
+    def iter_text(self, chunk_size=1 << 16):
+        """Yield the complete captured text in chunks.
+
+        Raises:
+            ValueError: If the full text was not kept, because ``spill_threshold`` is
+                None or the capture was closed, and is longer than the head and tail.
+        """
+        if self._spill is None:
+            if self._full or not self.truncated:
+                yield from list(self._full) if self._full else [self.summary()]
+                return
+            raise ValueError('The full text was not kept; use summary()')
+        with self._lock:
+            self._spill.flush()
+            self._spill.seek(0)
+            while True:
+                chunk = self._spill.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            self._spill.seek(0, 2)
+
+    def getvalue(self):
+        """Return the complete captured text, like ``StringIO.getvalue``."""
+        return ''.join(self.iter_text())
+
+    def close(self):
+        """Release the full text and remove the temporary file. The head and tail are kept."""
+        with self._lock:
+            self._full = []
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+            self.spill_threshold = None
+
+
+class _ThreadRoutedStream:
+    """Stand-in for ``sys.stderr`` that sends the writes of registered threads elsewhere.
+
+    Writes of all other threads go to the stream that was ``sys.stderr`` when it
+    was installed.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.routes = {}  # thread ident -> stream
+
+    def write(self, text):
+        return self.routes.get(threading.get_ident(), self.target).write(text)
+
+    def flush(self):
+        self.routes.get(threading.get_ident(), self.target).flush()
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+
+_route_lock = threading.Lock()
+
+
+@contextmanager
+def capture_thread_stderr(capture):
+    """Send what the current thread writes to ``sys.stderr`` to ``capture``.
+
+    Other threads keep writing to the previous ``sys.stderr``. If ``sys.stderr``
+    is replaced by someone else in the meantime, it is not restored afterwards.
+    """
+    ident = threading.get_ident()
+    with _route_lock:
+        router = sys.stderr
+        if not isinstance(router, _ThreadRoutedStream):
+            router = sys.stderr = _ThreadRoutedStream(sys.stderr)
+        previous = router.routes.get(ident)
+        router.routes[ident] = capture
+    try:
+        yield capture
+    finally:
+        with _route_lock:
+            if previous is None:
+                router.routes.pop(ident, None)
+            else:
+                router.routes[ident] = previous
+            if not router.routes and sys.stderr is router:
+                sys.stderr = router.target
@@ -0,0 +1,170 @@
+"""Command line interface of the ``snakehelper`` console script."""
+
+import argparse
+import json
+import sys
+
+
+def _serve(args):
+    from .daemon import serve
+    serve(args.socket, args.timeout)
+
+
+def _stop(args):
+    from .daemon import request
+    try:
+        request({'op': 'shutdown'}, args.socket, timeout=5.0)
+    except OSError as e:
+        print(f'No resolver daemon reachable: {e}', file=sys.stderr)
+        return 1
+
+
+def _status(args):
+    from .daemon import request
+    try:
+        reply = request({'op': 'stats'}, args.socket, timeout=5.0)
+    except OSError as e:
+        print(f'No resolver daemon reachable: {e}', file=sys.stderr)
+        return 1
+    print(json.dumps(reply['stats'], indent=2))
+
+
+def _forkserver(args):
+    from . import forkserver
+    if args.stop:
+        try:
+            forkserver.stop(args.socket)
+        except OSError as e:
+            print(f'No fork-server reachable: {e}', file=sys.stderr)
+            return 1
+        return
+    if args.targets and not args.snakefile:
+        print('--targets requires --snakefile', file=sys.stderr)
+        return 2
+    forkserver.serve(args.socket, args.snakefile, args.targets or (), rule=args.rule,
+                     prune_dag=args.prune_dag, virtual_inputs=args.virtual_inputs,
+                     stat_free=args.stat_free)
+
+
+def _launch(args):
+    from .forkserver import launch
+    try:
+        return launch([args.script, *args.args], args.socket)
+    except OSError as e:
+        print(f'No fork-server reachable: {e}', file=sys.stderr)
+        return 1
+
+
+def _index(args):
+    from .indexfile import build_index
+    from .SnakeIOHelper import _parser_options
+
+    targets = list(args.targets or [])
+    if args.targets_from:
+        with open(args.targets_from) as f:
+            targets += [line.strip() for line in f if line.strip()]
+    if not targets:
+        print('Give the targets with --targets or --targets-from', file=sys.stderr)
+        return 2
+    parser_options = _parser_options(args.rule, pruned=args.prune_dag,
+                                     virtual_inputs=args.virtual_inputs, stat_free=args.stat_free)
+    count = build_index(args.output, args.snakefile, targets, args.rule, **parser_options)
+    print(f'Wrote {count} jobs of rule {args.rule} to {args.output}')
+
+
+def _throughput(args):
+    from .throughput import parse_size, run_harness
+
+    targets = list(args.targets or [])
+    if args.targets_from:
+        with open(args.targets_from) as f:
+            targets += [line.strip() for line in f if line.strip()]
+    if not targets:
+        print('Give the targets with --targets or --targets-from', file=sys.stderr)
+        return 2
+    options = {'prune_dag': args.prune_dag, 'virtual_inputs': args.virtual_inputs,
+               'stat_free': args.stat_free}
+    if args.cache_dir:
+        options['cache_dir'] = args.cache_dir
+    report = run_harness(args.snakefile, targets, size=parse_size(args.size), mode=args.synthetic,
+                         jobs=args.jobs, workdir=args.workdir, **options)
+    text = json.dumps(report, indent=2, default=str)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='snakehelper',
+                                     description='Snakemake I/O helper utilities.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('serve', help='Run the resolver daemon in the foreground.')
+    p.add_argument('--socket', help='Unix socket path (default: $SNAKEHELPER_SOCKET or a per-user path).')
+    p.add_argument('--timeout', type=float, default=10.0,
+                   help='Seconds after which an idle client connection is closed (default: 10).')
+    p.set_defaults(func=_serve)
+
+    p = sub.add_parser('stop', help='Ask a running resolver daemon to exit.')
+    p.add_argument('--socket')
+    p.set_defaults(func=_stop)
+
+    p = sub.add_parser('status', help='Print the cache statistics of a running resolver daemon.')
+    p.add_argument('--socket')
+    p.set_defaults(func=_status)
+
+    p = sub.add_parser('forkserver',
+                       help='Run a fork-server that launches scripts with Snakemake preloaded.')
+    p.add_argument('--socket',
+                   help='Unix socket path (default: $SNAKEHELPER_FORKSERVER_SOCKET or a per-user path).')
+    p.add_argument('--snakefile', help='Workflow to compile before serving.')
+    p.add_argument('--targets', nargs='+', help='Target files the scripts will pass to getSnake.')
+    p.add_argument('--rule', help='Rule the scripts resolve (needed with --prune-dag).')
+    p.add_argument('--prune-dag', action='store_true')
+    p.add_argument('--virtual-inputs', action='store_true')
+    p.add_argument('--stat-free', action='store_true')
+    p.add_argument('--stop', action='store_true', help='Ask a running fork-server to exit.')
+    p.set_defaults(func=_forkserver)
+
+    p = sub.add_parser('launch', help='Run a Python script in a child of the fork-server.')
+    p.add_argument('--socket')
+    p.add_argument('script')
+    p.add_argument('args', nargs=argparse.REMAINDER)
+    p.set_defaults(func=_launch)
+
+    p = sub.add_parser('index',
+                       help='Resolve all jobs of a rule once and write them to a binary index file.')
+    p.add_argument('--snakefile', required=True)
+    p.add_argument('--rule', required=True)
+    p.add_argument('--targets', nargs='+', help='Target files; task i is the job for target i.')
+    p.add_argument('--targets-from', help='File with one target per line.')
+    p.add_argument('--output', required=True, help='Index file to write.')
+    p.add_argument('--prune-dag', action='store_true')
+    p.add_argument('--virtual-inputs', action='store_true')
+    p.add_argument('--stat-free', action='store_true')
+    p.set_defaults(func=_index)
+
+    p = sub.add_parser('throughput',
+                       help='Dry-execute the whole DAG with synthetic outputs and report the '
+                            'overhead, I/O volume and critical path per rule.')
+    p.add_argument('--snakefile', required=True)
+    p.add_argument('--targets', nargs='+')
+    p.add_argument('--targets-from', help='File with one target per line.')
+    p.add_argument('--size', default='1M', help='Size of each synthetic file, e.g. 4096, 64K or 2G.')
+    p.add_argument('--synthetic', choices=['sparse', 'fallocate', 'empty'], default='sparse',
+                   help='How synthetic files are created (default: sparse).')
+    p.add_argument('--jobs', '-j', type=int, default=1, help='Jobs to run at the same time.')
+    p.add_argument('--workdir', help='Directory to write the outputs to (default: current).')
+    p.add_argument('--cache-dir', help='Disk cache used by getSnake in every job.')
+    p.add_argument('--prune-dag', action='store_true')
+    p.add_argument('--virtual-inputs', action='store_true')
+    p.add_argument('--stat-free', action='store_true')
+    p.add_argument('--output', help='Write the report to this JSON file.')
+    p.set_defaults(func=_throughput)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args) or 0
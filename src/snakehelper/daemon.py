@@ -0,0 +1,211 @@
+"""Resolver daemon that keeps compiled workflows warm between script launches.
+
+``snakehelper serve`` listens on a local Unix socket and answers "rule X for
+targets Y" queries from its in-process ``parser_cache``. ``getSnake`` asks the
+daemon first whenever its socket exists and falls back to compiling the
+workflow itself if the daemon is not running or cannot answer.
+
+The protocol is one JSON object per line in each direction. A request is
+``{"op": "resolve", "snakefile", "targets", "rule", "cwd", "options"}`` and the reply is
+``{"ok": true, "record": ResolvedIO.to_dict()}`` or
+``{"ok": false, "error": ..., "message": ...}``.
+
+Two timeouts apply. A client waits ``$SNAKEHELPER_DAEMON_TIMEOUT`` seconds
+(default 30) for a reply; when that expires, ``getSnake`` compiles the workflow
+itself while the daemon carries on, so a cold compile that outlasts the timeout
+is done twice, but later queries are answered from the daemon. The daemon
+answers one connection at a time and drops a connection that sends nothing for
+``connection_timeout`` seconds (``snakehelper serve --timeout``, default 10),
+so a stalled client cannot block the others.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import tempfile
+from pathlib import Path
+
+from .resolved import ResolvedIO
+
+SOCKET_ENV = 'SNAKEHELPER_SOCKET'
+TIMEOUT_ENV = 'SNAKEHELPER_DAEMON_TIMEOUT'
+
+
+def default_socket_path():
+    """Return the socket path from ``$SNAKEHELPER_SOCKET`` or a per-user default."""
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'snakehelper.sock')
+    return os.path.join(tempfile.gettempdir(), f'snakehelper-{os.getuid()}.sock')
+
+
+def default_timeout():
+    """Return the seconds a client waits for a reply, from ``$SNAKEHELPER_DAEMON_TIMEOUT``."""
+    return float(os.environ.get(TIMEOUT_ENV, 30.0))
+
+
+def _send(sock_file, obj):
+    sock_file.write(json.dumps(obj, default=str).encode() + b'\n')
+    sock_file.flush()
+
+
+def request(payload, socket_path=None, timeout=None):
+    """Send one request to the daemon and return its decoded reply.
+
+    Args:
+        timeout (float): Seconds to wait for the reply (default: ``default_timeout()``).
+
+    Raises:
+        OSError: If the daemon is not reachable or does not reply in time
+            (``TimeoutError``).
+    """
+    socket_path = socket_path or default_socket_path()
+    if timeout is None:
+        timeout = default_timeout()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        with sock.makefile('rwb') as f:
+            _send(f, payload)
+            line = f.readline()
+    if not line:
+        raise ConnectionError('Resolver daemon closed the connection without replying')
+    return json.loads(line)
+
+
+def query(snakefile, targets, rule, options=None, socket_path=None, timeout=None):
+    """Resolve a rule through a running daemon.
+
+    Args:
+        options (dict): ``IOParser`` keyword arguments selecting the resolution mode.
+        timeout (float): Seconds to wait for the reply (default: ``default_timeout()``).
+            When it expires, None is returned and the daemon keeps compiling, so
+            that its next query for the workflow is answered from its cache.
+
+    Returns:
+        ResolvedIO or None: None if no daemon is running or it could not resolve
+        the rule, in which case the caller should resolve locally.
+    """
+    socket_path = socket_path or default_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    try:
+        reply = request({
+            'op': 'resolve',
+            'snakefile': os.path.abspath(snakefile),
+            'targets': [str(t) for t in targets],
+            'rule': rule,
+            'cwd': os.getcwd(),
+            'options': options or {},
+        }, socket_path, timeout)
+    except (OSError, ValueError):
+        return None
+    if not reply.get('ok'):
+        return None
+    return ResolvedIO.from_dict(reply['record'])
+
+
+def _resolve(req):
+    from .SnakeIOHelper import IOParser
+    from .cache import parser_cache
+
+    old_cwd = os.getcwd()
+    os.chdir(req['cwd'])
+    try:
+        parser_options = req.get('options') or {}
+        options = tuple(sorted(parser_options.items()))
+        parser = parser_cache.get(req['snakefile'], req['targets'], options)
+        if parser is None:
+            parser = IOParser(req['snakefile'], req['targets'], **parser_options)
+            parser_cache.put(req['snakefile'], req['targets'], parser, options)
+        job = parser.getInputOutput4rule(req['rule'])
+        return ResolvedIO.from_job(job)
+    finally:
+        os.chdir(old_cwd)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        self.timeout = self.server.connection_timeout
+        super().setup()
+
+    def handle(self):
+        try:
+            self._handle()
+        except TimeoutError:
+            pass  # idle client; drop it so the next connection is served
+
+    def _handle(self):
+        for line in self.rfile:
+            try:
+                req = json.loads(line)
+                op = req.get('op')
+                if op == 'resolve':
+                    reply = {'ok': True, 'record': _resolve(req).to_dict()}
+                elif op == 'ping':
+                    reply = {'ok': True, 'pid': os.getpid()}
+                elif op == 'stats':
+                    from .cache import parser_cache
+                    reply = {'ok': True, 'stats': parser_cache.stats()}
+                elif op == 'shutdown':
+                    reply = {'ok': True}
+                    self.server.shutdown_requested = True
+                else:
+                    reply = {'ok': False, 'error': 'ValueError', 'message': f'Unknown op: {op!r}'}
+            except Exception as e:
+                reply = {'ok': False, 'error': type(e).__name__, 'message': str(e)}
+            _send(self.wfile, reply)
+
+
+class ResolverServer(socketserver.UnixStreamServer):
+    """Single-threaded Unix socket server answering resolution queries.
+
+    Requests are handled one at a time because resolving a rule changes the
+    process working directory.
+
+    Args:
+        connection_timeout (float): Seconds after which a connection that sends
+            no request, or does not read its reply, is closed. None waits forever.
+    """
+
+    def __init__(self, socket_path, connection_timeout=10.0):
+        self.socket_path = socket_path
+        self.connection_timeout = connection_timeout
+        self.shutdown_requested = False
+        if os.path.exists(socket_path):
+            try:
+                request({'op': 'ping'}, socket_path, timeout=1.0)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Stale socket left by a dead daemon
+                Path(socket_path).unlink(missing_ok=True)
+            except OSError:
+                pass  # e.g. the ping timed out because the daemon is busy compiling
+            if os.path.exists(socket_path):
+                raise RuntimeError(f'A resolver daemon is already listening on {socket_path}')
+        Path(socket_path).parent.mkdir(parents=True, exist_ok=True)
+        old_umask = os.umask(0o177)  # socket is only accessible by the current user
+        try:
+            super().__init__(socket_path, _Handler)
+        finally:
+            os.umask(old_umask)
+
+    def serve_until_shutdown(self):
+        try:
+            while not self.shutdown_requested:
+                self.handle_request()
+        finally:
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+def serve(socket_path=None, connection_timeout=10.0):
+    """Run the resolver daemon in the foreground until a shutdown request arrives."""
+    socket_path = socket_path or default_socket_path()
+    server = ResolverServer(socket_path, connection_timeout)
+    print('snakehelper resolver listening on ' + socket_path)
+    server.serve_until_shutdown()
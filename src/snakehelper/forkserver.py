@@ -0,0 +1,232 @@
+"""Fork-server that starts scripts from a process with Snakemake already loaded.
+
+``snakehelper forkserver`` imports Snakemake, compiles a workflow into the
+in-process ``parser_cache`` and waits on a Unix socket. ``snakehelper launch
+script.py ...`` connects to it and passes its stdin, stdout and stderr with
+``socket.send_fds``. The server forks, and the child runs the script as
+``__main__`` with the caller's working directory, environment and arguments.
+The child inherits the imported modules and the compiled workflow
+copy-on-write, so ``getSnake`` in the script returns without importing
+Snakemake or compiling anything.
+
+The launcher forwards SIGINT and SIGTERM to the script and exits with its
+exit code. It only imports the standard library, so it starts in
+milliseconds.
+"""
+
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+
+FORKSERVER_SOCKET_ENV = 'SNAKEHELPER_FORKSERVER_SOCKET'
+
+
+def default_socket_path():
+    """Return the socket path from ``$SNAKEHELPER_FORKSERVER_SOCKET`` or a per-user default."""
+    path = os.environ.get(FORKSERVER_SOCKET_ENV)
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'snakehelper-fork.sock')
+    return os.path.join(tempfile.gettempdir(), f'snakehelper-fork-{os.getuid()}.sock')
+
+
+def _connect(socket_path, timeout=None):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _send(sock, obj):
+    sock.sendall(json.dumps(obj).encode() + b'\n')
+
+
+class ForkServer:
+    """Unix socket server forking a child process for each launched script.
+
+    Args:
+        socket_path (str): Socket to listen on
+        snakefile (str): Workflow to compile before serving, optional
+        targets (list): Target files of the workflow
+        **parser_options: ``getSnake`` resolution options (``rule``, ``prune_dag``,
+            ``virtual_inputs``, ``stat_free``); scripts must use the same ones
+            to find the compiled workflow.
+    """
+
+    def __init__(self, socket_path, snakefile=None, targets=(), **parser_options):
+        self.socket_path = socket_path
+        if snakefile is not None:
+            self._precompile(snakefile, targets, **parser_options)
+
+        if os.path.exists(socket_path):
+            try:
+                _connect(socket_path, timeout=1.0).close()
+            except OSError:
+                os.unlink(socket_path)  # stale socket left by a dead server
+            else:
+                raise RuntimeError(f'A fork-server is already listening on {socket_path}')
+        os.makedirs(os.path.dirname(socket_path) or '.', exist_ok=True)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)  # socket is only accessible by the current user
+        try:
+            self._sock.bind(socket_path)
+        finally:
+            os.umask(old_umask)
+        self._sock.listen(64)
+
+    @staticmethod
+    def _precompile(snakefile, targets, rule=None, prune_dag=False, virtual_inputs=False,
+                    stat_free=False):
+        import gc
+
+        from .cache import parser_cache
+        from .SnakeIOHelper import IOParser, _parser_options
+
+        parser_options = _parser_options(rule, pruned=prune_dag, virtual_inputs=virtual_inputs,
+                                         stat_free=stat_free)
+        parser = IOParser(snakefile, targets, **parser_options)
+        parser_cache.put(snakefile, targets, parser, tuple(sorted(parser_options.items())))
+        # Keep the garbage collector from touching, and so copying, the inherited objects
+        gc.collect()
+        gc.freeze()
+
+    def serve_forever(self):
+        # Children are reaped automatically; they report their exit code themselves
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        try:
+            while True:
+                conn, _ = self._sock.accept()
+                try:
+                    if not self._handle(conn):
+                        return
+                finally:
+                    conn.close()
+        finally:
+            self._sock.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def _handle(self, conn):
+        """Serve one connection; return False when asked to shut down."""
+        try:
+            _, fds, _, _ = socket.recv_fds(conn, 1, 3)
+            with conn.makefile('rb') as f:
+                req = json.loads(f.readline())
+        except (OSError, ValueError):
+            return True
+        if req.get('op') == 'shutdown':
+            _send(conn, {'ok': True})
+            return False
+        if req.get('op') == 'ping':
+            _send(conn, {'ok': True, 'pid': os.getpid()})
+            return True
+
+        # Flush so that buffered output of the server is not written again by the child
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self._sock.close()
+            _run_child(conn, fds, req)  # never returns
+        for fd in fds:
+            os.close(fd)
+        return True
+
+
+def _run_child(conn, fds, req):
+    code = 1
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        _send(conn, {'pid': os.getpid()})
+        for target, fd in zip((0, 1, 2), fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.chdir(req['cwd'])
+        os.environ.clear()
+        os.environ.update(req['env'])
+        code = _run_script(req['argv'])
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        try:
+            _send(conn, {'exit': code})
+        finally:
+            os._exit(code)
+
+
+def _run_script(argv):
+    """Run ``argv[0]`` as ``__main__`` and return its exit code."""
+    import runpy
+    import traceback
+
+    sys.argv = list(argv)
+    sys.path[0] = os.path.dirname(os.path.abspath(argv[0]))
+    try:
+        runpy.run_path(argv[0], run_name='__main__')
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def launch(argv, socket_path=None):
+    """Run a script in a child of the fork-server and return its exit code.
+
+    Raises:
+        OSError: If no fork-server is reachable.
+    """
+    socket_path = socket_path or default_socket_path()
+    with _connect(socket_path) as sock:
+        socket.send_fds(sock, [b'F'], [0, 1, 2])
+        _send(sock, {'op': 'run', 'argv': list(argv), 'cwd': os.getcwd(),
+                     'env': dict(os.environ)})
+        with sock.makefile('rb') as f:
+            pid = json.loads(f.readline())['pid']
+
+            def forward(signum, _frame):
+                try:
+                    os.kill(pid, signum)
+                except ProcessLookupError:
+                    pass
+
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, forward)
+            line = f.readline()
+    # No exit code means the child died without reporting one
+    return json.loads(line)['exit'] if line else 1
+
+
+def stop(socket_path=None):
+    """Ask a running fork-server to exit."""
+    socket_path = socket_path or default_socket_path()
+    with _connect(socket_path, timeout=5.0) as sock:
+        socket.send_fds(sock, [b'F'], [])
+        _send(sock, {'op': 'shutdown'})
+        sock.makefile('rb').readline()
+
+
+def serve(socket_path=None, snakefile=None, targets=(), **parser_options):
+    """Run the fork-server in the foreground until ``stop`` is called."""
+    socket_path = socket_path or default_socket_path()
+    server = ForkServer(socket_path, snakefile, targets, **parser_options)
+    print('snakehelper fork-server listening on ' + socket_path, flush=True)
+    server.serve_forever()
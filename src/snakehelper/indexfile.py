@@ -0,0 +1,201 @@
+"""Binary index of resolved jobs for HPC array tasks.
+
+``snakehelper index`` resolves every job of a rule once and writes them to an
+index file. Each array task then reads only its own record, by task number
+or by wildcard values, through ``mmap``. Reading needs neither Snakemake
+nor a compile of the workflow.
+
+File layout (little endian)::
+
+    header   magic b'SHIDX\\x00\\x00\\x01', record count (u32), hash slot count (u32),
+             offset of the record table (u64), offset of the hash table (u64)
+    records  ResolvedIO.to_dict() of each job as UTF-8 JSON, back to back
+    table    (offset u64, length u32) of each record, in task order
+    hashes   open addressing table of u32 slots holding record number + 1,
+             keyed by the blake2b hash of the wildcards key (0 = empty)
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+from .resolved import ResolvedIO, wildcards_key
+
+MAGIC = b'SHIDX\x00\x00\x01'
+TASK_ENV = 'SLURM_ARRAY_TASK_ID'
+
+_HEADER = struct.Struct('<8sIIQQ')
+_ENTRY = struct.Struct('<QI')
+_SLOT = struct.Struct('<I')
+
+
+def key_string(wildcards):
+    """Canonical text key of a wildcards mapping, e.g. ``'recording=M1_D1'``."""
+    return ','.join(f'{name}={value}' for name, value in wildcards_key(wildcards))
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+
+
+def write_index(path, records):
+    """Write ``ResolvedIO`` records to an index file, atomically.
+
+    The position of a record in ``records`` is its task number.
+    """
+    records = list(records)
+    slots = 1
+    while slots < 2 * len(records):
+        slots *= 2
+    table = [0] * slots
+    blobs = []
+    for i, record in enumerate(records):
+        blobs.append(json.dumps(record.to_dict(), separators=(',', ':'), default=str).encode())
+        slot = _hash(key_string(record.wildcards)) & (slots - 1)
+        while table[slot]:
+            slot = (slot + 1) & (slots - 1)
+        table[slot] = i + 1
+
+    path = os.fspath(path)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'\0' * _HEADER.size)
+            offsets = []
+            for blob in blobs:
+                offsets.append((f.tell(), len(blob)))
+                f.write(blob)
+            table_offset = f.tell()
+            for offset, length in offsets:
+                f.write(_ENTRY.pack(offset, length))
+            hash_offset = f.tell()
+            f.write(b''.join(_SLOT.pack(s) for s in table))
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, len(records), slots, table_offset, hash_offset))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class IndexFile:
+    """Read-only, memory-mapped view of an index file written by ``write_index``.
+
+    ``index[i]`` returns the record of task ``i`` and ``index.get(recording='M1_D1')``
+    the record with these wildcard values; both decode only that one record.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, self._slots, self._table, self._hashes = \
+            _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f'{path} is not a snakehelper index file')
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, task):
+        if task < 0:
+            task += self._count
+        if not 0 <= task < self._count:
+            raise IndexError(f'Task {task} out of range for an index of {self._count} jobs')
+        offset, length = _ENTRY.unpack_from(self._mm, self._table + task * _ENTRY.size)
+        return ResolvedIO.from_dict(json.loads(self._mm[offset:offset + length]))
+
+    def get(self, **wildcards):
+        """Return the record with exactly these wildcard values.
+
+        Raises:
+            KeyError: If the index has no such job.
+        """
+        key = key_string(wildcards)
+        slot = _hash(key) & (self._slots - 1)
+        while True:
+            (entry,) = _SLOT.unpack_from(self._mm, self._hashes + slot * _SLOT.size)
+            if not entry:
+                raise KeyError(f'No job with wildcards {key!r} in the index')
+            record = self[entry - 1]
+            if key_string(record.wildcards) == key:
+                return record
+            slot = (slot + 1) & (self._slots - 1)
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def build_index(path, snakefile, targets, rule, **parser_options):
+    """Resolve all jobs of ``rule`` once and write them to an index file.
+
+    Jobs producing one of the ``targets`` come first, in the order of the targets,
+    so task ``i`` is the job for ``targets[i]``. Other jobs of the rule follow,
+    sorted by their wildcards.
+
+    Returns:
+        int: The number of jobs written.
+    """
+    from .SnakeIOHelper import IOParser
+
+    parser = IOParser(snakefile, targets, **parser_options)
+    jobs = list(parser.iter_jobs(rule=rule))
+    by_output = {os.path.normpath(str(f)): job for job in jobs for f in job.output}
+    ordered = {}  # insertion-ordered set
+    for target in targets:
+        job = by_output.get(os.path.normpath(str(target)))
+        if job is not None:
+            ordered[job] = None
+    rest = sorted(set(jobs).difference(ordered), key=lambda job: wildcards_key(job.wildcards))
+    ordered = [*ordered, *rest]
+    write_index(path, (ResolvedIO.from_job(job) for job in ordered))
+    return len(ordered)
+
+
+def get_snake(locals, index_path, task=None, wildcards=None, createFolder=True,
+              redirect_error=True, return_snake_obj=False):
+    """``getSnake`` for array tasks, reading the job from an index file.
+
+    Args:
+    locals (dict): Local variables dictionary of caller script
+    index_path (str): Index file written by ``snakehelper index``
+    task (int): Task number; defaults to ``$SLURM_ARRAY_TASK_ID``
+    wildcards (dict): Look the job up by wildcard values instead of the task number
+    createFolder (bool): Whether or not to create output folders. Default is True.
+
+    Returns:
+    Tuple: The same as ``getSnake``; the snake object is a ``ResolvedIO`` record.
+    """
+    from .SnakeIOHelper import getSnake, makeFolders, prepare_logger
+
+    if 'snakemake' in locals:
+        return getSnake(locals, None, [], None, redirect_error=redirect_error,
+                        createFolder=createFolder, return_snake_obj=return_snake_obj)
+
+    with IndexFile(index_path) as index:
+        if wildcards is not None:
+            record = index.get(**wildcards)
+        else:
+            if task is None:
+                if TASK_ENV not in os.environ:
+                    raise ValueError(f'Pass task or wildcards, or set ${TASK_ENV}')
+                task = int(os.environ[TASK_ENV])
+            record = index[task]
+
+    if createFolder:
+        makeFolders(record.output)
+    if redirect_error and createFolder and len(record.log) > 0:
+        prepare_logger(record.log[0])
+
+    if return_snake_obj:
+        return (record.input, record.output, record)
+    return (record.input, record.output)
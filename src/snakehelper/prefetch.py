@@ -0,0 +1,114 @@
+"""Start resolving a workflow in the background before ``getSnake`` is called.
+
+A notebook or script calls ``prefetch`` near the top, before its own heavy
+imports. The workflow is compiled on a background thread (or in a worker
+process) while the script carries on. The later ``getSnake`` call with the
+same Snakefile and targets collects the result, waiting for it if the
+compile has not finished yet.
+"""
+
+import threading
+
+from .cache import parser_cache
+
+_pending = {}  # parser_cache key (+ rule for process prefetches) -> Future
+_pending_lock = threading.Lock()
+
+
+def prefetch(snakefile, targets, rule=None, prune_dag=False, virtual_inputs=False,
+             stat_free=False, executor='thread', change_working_dir=True):
+    """Start resolving a workflow in the background and return a future.
+
+    Args:
+        snakefile (str): Snakefile location
+        targets (list): Target files, as later passed to ``getSnake``
+        rule (str): The rule that will be resolved. Required with ``prune_dag``
+            or ``executor='process'``.
+        prune_dag (bool): Same as for ``getSnake``
+        virtual_inputs (bool): Same as for ``getSnake``
+        stat_free (bool): Same as for ``getSnake``
+        executor (str): ``'thread'`` compiles the workflow on a background thread and the
+            future gives the ``IOParser``. ``'process'`` resolves ``rule`` in a worker process,
+            which does not compete with the script for the GIL, and the future gives a
+            ``ResolvedIO`` record.
+        change_working_dir (bool): Switch to ``$SNAKEMAKE_DEBUG_ROOT`` first, as ``getSnake``
+            does. Default is True.
+
+    Returns:
+        concurrent.futures.Future: Collected by the next matching ``getSnake`` call.
+    """
+    from .SnakeIOHelper import _change_to_debug_root, _parser_options
+
+    if executor not in ('thread', 'process'):
+        raise ValueError(f"executor must be 'thread' or 'process', not {executor!r}")
+    if rule is None and (prune_dag or executor == 'process'):
+        raise ValueError('rule is required with prune_dag or the process executor')
+    if change_working_dir:
+        _change_to_debug_root()
+
+    targets = [str(t) for t in targets]
+    parser_options = _parser_options(rule, pruned=prune_dag, virtual_inputs=virtual_inputs,
+                                     stat_free=stat_free)
+    key = _key(snakefile, targets, rule, parser_options, executor == 'process')
+    with _pending_lock:
+        future = _pending.get(key)
+        if future is None:
+            future = _pending[key] = _submit(snakefile, targets, rule, parser_options, executor)
+    return future
+
+
+def _key(snakefile, targets, rule, parser_options, process):
+    key = parser_cache.key(snakefile, targets, tuple(sorted(parser_options.items())))
+    return key + (rule,) if process else key
+
+
+def _submit(snakefile, targets, rule, parser_options, executor):
+    import os
+    from concurrent.futures import Future
+
+    from .SnakeIOHelper import IOParser, _get_process_pool, _resolve_in_worker
+
+    if executor == 'process':
+        options = {'prune_dag': parser_options.get('pruned', False),
+                   'virtual_inputs': parser_options.get('virtual_inputs', False),
+                   'stat_free': parser_options.get('stat_free', False)}
+        return _get_process_pool().submit(_resolve_in_worker, snakefile, targets, rule,
+                                          os.getcwd(), options)
+
+    future = Future()
+    future.set_running_or_notify_cancel()
+
+    def run():
+        try:
+            future.set_result(IOParser(snakefile, targets, **parser_options))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='snakehelper-prefetch', daemon=True).start()
+    return future
+
+
+def collect(snakefile, targets, rule, parser_options):
+    """Return the prefetched result for a ``getSnake`` call, or None.
+
+    Waits for a prefetch that is still running. Returns an ``IOParser`` for
+    thread prefetches and a ``ResolvedIO`` for process prefetches. A failed
+    prefetch returns None, so that the caller compiles again and reports
+    the error itself.
+    """
+    if not _pending:
+        return None
+    for process in (False, True):
+        key = _key(snakefile, targets, rule, parser_options, process)
+        with _pending_lock:
+            future = _pending.pop(key, None)
+        if future is None:
+            continue
+        try:
+            if not process:
+                return future.result()
+            record, record.timing = future.result()
+            return record
+        except Exception:
+            return None
+    return None
@@ -0,0 +1,179 @@
+"""Plain-Python records of a resolved Snakemake job.
+
+These mirror the parts of a Snakemake ``Job`` that scripts actually use
+(``input``, ``output``, ``log``, ...), but hold only strings and plain values
+so they can be stored in a cache or sent to worker processes without keeping
+Snakemake objects alive.
+"""
+
+
+def wildcards_key(wildcards):
+    """Turn a wildcards mapping into a hashable, order-independent key."""
+    return tuple(sorted((name, str(value)) for name, value in wildcards.items()))
+
+
+class PathString(str):
+    """A plain path string that, like Snakemake's files, has ``flags``.
+
+    ``makeFolders`` uses the flags to tell ``directory()`` outputs from files.
+    """
+
+    flags = {}
+
+
+class DirectoryPath(PathString):
+    """A path string marking a Snakemake ``directory()`` output."""
+
+    flags = {'directory': True}
+
+
+def _plain(value):
+    if getattr(value, 'flags', {}).get('directory'):
+        return DirectoryPath(value)
+    return PathString(value)
+
+
+class NamedPaths(list):
+    """A list whose items can also be accessed by name.
+
+    Behaves like Snakemake's ``Namedlist``: ``paths.recording_info``,
+    ``paths['recording_info']`` and ``paths[0]`` all work, and ``items()``
+    yields the named entries only.
+    """
+
+    def __init__(self, values=(), names=None):
+        super().__init__(values)
+        # name -> (start, end); end is None for a single item
+        self._names = dict(names or {})
+
+    @classmethod
+    def from_namedlist(cls, namedlist, plain=True):
+        """Copy a Snakemake ``Namedlist`` (or any iterable).
+
+        Args:
+            namedlist: The list to copy. Names are taken over when present.
+            plain (bool): Convert the items to ``str`` (for file lists).
+        """
+        values = [_plain(v) for v in namedlist] if plain else list(namedlist)
+        names = {}
+        get_names = getattr(namedlist, '_get_names', None)
+        if get_names is not None:
+            names = {name: tuple(index) for name, index in get_names()}
+        return cls(values, names)
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name == '_names':
+            raise AttributeError(name)
+        try:
+            start, end = self._names[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        if end is None:
+            return self[start]
+        return NamedPaths(self[start:end])
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return super().__getitem__(key)
+
+    def keys(self):
+        return self._names.keys()
+
+    def items(self):
+        for name in self._names:
+            yield name, getattr(self, name)
+
+    def get(self, key, default=None):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            return default
+
+    def __str__(self):
+        return ' '.join(map(str, self))
+
+    def to_dict(self):
+        """Return a JSON-friendly representation."""
+        return {
+            'values': list(self),
+            'names': {k: list(v) for k, v in self._names.items()},
+            'paths': bool(self) and all(isinstance(v, PathString) for v in self),
+            'directories': [i for i, v in enumerate(self) if isinstance(v, DirectoryPath)],
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        values = list(d['values'])
+        if d.get('paths'):
+            values = [PathString(v) for v in values]
+        for i in d.get('directories', ()):
+            values[i] = DirectoryPath(values[i])
+        return cls(values, {k: tuple(v) for k, v in d['names'].items()})
+
+
+def _plain_resource(value):
+    # Unevaluated resources are Snakemake string subclasses; keep only the text
+    return str(value) if isinstance(value, str) else value
+
+
+_FIELDS = ('input', 'output', 'log', 'params', 'wildcards', 'resources')
+
+
+class ResolvedIO:
+    """The input, output, log, params, wildcards, threads and resources of one resolved job.
+
+    Holds no reference to the Snakemake job, rule, DAG or workflow, and
+    pickles as a plain tuple of its fields.
+    """
+
+    __slots__ = ('name', 'input', 'output', 'log', 'params', 'wildcards', 'threads',
+                 'resources', 'timing')
+
+    def __init__(self, name, input, output, log, params, wildcards, threads=1, resources=None):
+        self.name = name
+        self.input = input
+        self.output = output
+        self.log = log
+        self.params = params
+        self.wildcards = wildcards
+        self.threads = threads
+        self.resources = resources if resources is not None else NamedPaths()
+        self.timing = None  # PhaseTimer of the getSnake call that returned the record
+
+    @classmethod
+    def from_job(cls, job):
+        """Build a record from a Snakemake ``Job`` or the ``snakemake`` object of a script."""
+        name = getattr(job, 'name', None) or getattr(job, 'rule', None)
+        resources = NamedPaths.from_namedlist(getattr(job, 'resources', ()), plain=False)
+        resources[:] = map(_plain_resource, resources)
+        return cls(
+            name=name,
+            input=NamedPaths.from_namedlist(job.input),
+            output=NamedPaths.from_namedlist(job.output),
+            log=NamedPaths.from_namedlist(job.log),
+            params=NamedPaths.from_namedlist(job.params, plain=False),
+            wildcards=NamedPaths.from_namedlist(job.wildcards),
+            threads=getattr(job, 'threads', 1),
+            resources=resources,
+        )
+
+    def __reduce__(self):
+        return (ResolvedIO, (self.name, self.input, self.output, self.log, self.params,
+                             self.wildcards, self.threads, self.resources))
+
+    def to_dict(self):
+        """Return a JSON-friendly representation (see ``from_dict``)."""
+        d = {'name': self.name, 'threads': self.threads}
+        for field in _FIELDS:
+            d[field] = getattr(self, field).to_dict()
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(name=d['name'], threads=d.get('threads', 1), **{
+            field: NamedPaths.from_dict(d[field]) for field in _FIELDS if field in d
+        })
+
+    def __repr__(self):
+        return f'ResolvedIO(name={self.name!r}, output={list(self.output)!r})'
@@ -0,0 +1,252 @@
+"""Throughput harness that dry-executes a whole workflow with synthetic data.
+
+``run_harness`` builds the DAG with ``IOParser`` and runs every job in
+dependency order, like Snakemake would. Each job is a fresh interpreter
+standing in for the rule's script: it resolves its I/O with ``getSnake`` in
+standalone mode, as the script preamble does, and then writes synthetic
+outputs of a configurable size instead of doing real work. Missing raw
+inputs are created the same way. Outputs are ``sparse`` (only the file
+length is set), ``fallocate`` (blocks are reserved on disk) or ``empty``.
+
+The report lists, per rule, the number of jobs, the time spent in the job
+process outside of writing outputs (interpreter start, imports and
+``getSnake``), the bytes read and written, and the share of the critical
+path, i.e. the longest chain of dependent jobs by measured wall time. With
+``jobs > 1`` independent jobs run in parallel, so the makespan can be
+compared with the critical path to find scheduling bottlenecks.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+SYNTHETIC_MODES = ('sparse', 'fallocate', 'empty')
+
+_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(text):
+    """Parse a byte count such as ``4096``, ``64K`` or ``1.5G``."""
+    text = str(text).strip().upper().removesuffix('B').removesuffix('I')
+    unit = text[-1:] if text[-1:] in _UNITS else ''
+    return int(float(text[:len(text) - len(unit)]) * _UNITS[unit])
+
+
+def write_synthetic(path, size, mode='sparse'):
+    """Create or overwrite ``path`` with ``size`` bytes of synthetic content.
+
+    Returns:
+        int: The size of the file.
+    """
+    if mode not in SYNTHETIC_MODES:
+        raise ValueError(f'Unknown synthetic mode {mode!r}, expected one of {SYNTHETIC_MODES}')
+    if mode == 'empty':
+        size = 0
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        if mode == 'fallocate' and size:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, size)
+            else:
+                # No fallocate on this platform; write zeros so that the blocks are allocated
+                chunk = b'\0' * min(size, 1 << 20)
+                for start in range(0, size, len(chunk)):
+                    f.write(chunk[:size - start])
+        else:
+            f.truncate(size)
+    return size
+
+
+def toposort(dag):
+    """Return the jobs of ``dag`` in dependency order and the dependencies of each job."""
+    jobs = list(dag.jobs)
+    members = set(jobs)
+    deps = {job: [d for d in dag.dependencies[job] if d in members] for job in jobs}
+    order, done = [], set()
+
+    def visit(job, stack):
+        # Iterative depth-first search; long pipelines would exceed the recursion limit
+        stack.append((job, iter(deps[job])))
+        while stack:
+            node, children = stack[-1]
+            child = next((c for c in children if c not in done), None)
+            if child is None:
+                stack.pop()
+                if node not in done:
+                    done.add(node)
+                    order.append(node)
+            else:
+                stack.append((child, iter(deps[child])))
+
+    for job in jobs:
+        if job not in done:
+            visit(job, [])
+    return order, deps
+
+
+def _run_job():
+    """Body of a job process: resolve with ``getSnake`` and write synthetic outputs."""
+    start = time.perf_counter()
+    task = json.load(sys.stdin)
+    from .SnakeIOHelper import _is_directory_output, getSnake
+
+    sinput, soutput, snake = getSnake({}, task['snakefile'], [task['target']], task['rule'],
+                                      return_snake_obj=True, change_working_dir=False,
+                                      **task['options'])
+    resolved = time.perf_counter()
+    input_bytes = 0
+    for path in sinput:
+        if os.path.isfile(path):
+            input_bytes += os.path.getsize(path)
+    output_bytes = 0
+    for path in soutput:
+        if _is_directory_output(path):
+            path = os.path.join(path, 'synthetic.dat')
+        output_bytes += write_synthetic(path, task['size'], task['mode'])
+    end = time.perf_counter()
+    timing = getattr(snake, 'timing', None)
+    print(json.dumps({
+        'resolve_s': resolved - start,
+        'write_s': end - resolved,
+        'input_bytes': input_bytes,
+        'output_bytes': output_bytes,
+        'phases': timing.to_dict()['phases'] if timing is not None else {},
+    }))
+
+
+def _launch(task, cwd):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-c',
+                           'from snakehelper.throughput import _run_job; _run_job()'],
+                          input=json.dumps(task), capture_output=True, text=True, cwd=cwd)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f'Job of rule {task["rule"]} for {task["target"]} failed:\n'
+                           f'{proc.stderr[-4000:]}')
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['wall_s'] = wall
+    # Everything in the job except the synthetic work itself
+    result['overhead_s'] = wall - result['write_s']
+    return result
+
+
+def run_harness(snakefile, targets, size=1 << 20, mode='sparse', jobs=1, workdir=None,
+                **options):
+    """Dry-execute all jobs of the DAG for ``targets`` and report their cost per rule.
+
+    Args:
+        snakefile (str): Snakefile of the workflow
+        targets (list): Target files to build the DAG for
+        size (int): Size in bytes of each synthetic output and raw input
+        mode (str): ``'sparse'``, ``'fallocate'`` or ``'empty'``
+        jobs (int): Number of jobs to run at the same time
+        workdir (str): Directory the outputs are written to; defaults to the current one
+        **options: Keyword arguments passed to ``getSnake`` in every job, e.g.
+            ``stat_free=True`` or ``cache_dir=...``
+
+    Returns:
+        dict: JSON-friendly report with ``rules``, ``jobs`` and the totals.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    from .SnakeIOHelper import IOParser
+
+    workdir = os.path.abspath(workdir or os.getcwd())
+    snakefile = os.path.abspath(snakefile)
+    old_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        # Build the DAG without touching the filesystem for missing raw inputs
+        parser = IOParser(snakefile, targets, virtual_inputs=True)
+        raw_bytes = sum(write_synthetic(path, size, mode) for path in sorted(parser.missing_inputs))
+    finally:
+        os.chdir(old_cwd)
+    order, deps = toposort(parser.dag)
+    position = {job: i for i, job in enumerate(order)}
+    dependents = {job: [] for job in order}
+    for job in order:
+        for dep in deps[job]:
+            dependents[dep].append(job)
+
+    results = {}
+    waiting = {job: len(deps[job]) for job in order}
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        running = {}
+
+        def submit(job):
+            if not job.output:
+                # Aggregation rules such as ``all`` have nothing to run
+                results[job] = {'wall_s': 0.0, 'overhead_s': 0.0, 'resolve_s': 0.0,
+                                'write_s': 0.0, 'input_bytes': 0, 'output_bytes': 0,
+                                'phases': {}, 'start_s': time.perf_counter() - t0}
+                release(job)
+                return
+            task = {'snakefile': snakefile, 'target': str(job.output[0]), 'rule': job.name,
+                    'size': size, 'mode': mode, 'options': options}
+            running[pool.submit(_launch, task, workdir)] = (job, time.perf_counter() - t0)
+
+        def release(job):
+            for child in sorted(dependents[job], key=position.get):
+                waiting[child] -= 1
+                if not waiting[child]:
+                    submit(child)
+
+        for job in order:
+            if not waiting[job]:
+                submit(job)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: position[running[f][0]]):
+                job, started = running.pop(future)
+                results[job] = {**future.result(), 'start_s': started}
+                release(job)
+    makespan = time.perf_counter() - t0
+
+    # Longest chain of dependent jobs by measured wall time
+    finish, via = {}, {}
+    for job in order:
+        before = max(deps[job], key=finish.get, default=None)
+        finish[job] = results[job]['wall_s'] + (finish[before] if before is not None else 0.0)
+        via[job] = before
+    critical = []
+    job = max(order, key=finish.get, default=None)
+    while job is not None:
+        critical.append(job)
+        job = via[job]
+    critical.reverse()
+
+    rules = {}
+    for job in order:
+        r = results[job]
+        stats = rules.setdefault(job.name, {'jobs': 0, 'wall_s': 0.0, 'overhead_s': 0.0,
+                                            'resolve_s': 0.0, 'input_bytes': 0,
+                                            'output_bytes': 0, 'critical_path_s': 0.0})
+        stats['jobs'] += 1
+        for key in ('wall_s', 'overhead_s', 'resolve_s', 'input_bytes', 'output_bytes'):
+            stats[key] += r[key]
+    for job in critical:
+        rules[job.name]['critical_path_s'] += results[job]['wall_s']
+    for stats in rules.values():
+        stats['mean_overhead_s'] = stats['overhead_s'] / stats['jobs']
+
+    serial = sum(r['wall_s'] for r in results.values())
+    return {
+        'snakefile': snakefile,
+        'size': size,
+        'mode': mode,
+        'parallel_jobs': jobs,
+        'jobs': len(order),
+        'raw_input_bytes': raw_bytes,
+        'makespan_s': makespan,
+        'serial_s': serial,
+        'critical_path_s': finish[critical[-1]] if critical else 0.0,
+        'critical_path': [{'rule': job.name, 'wildcards': dict(job.wildcards)}
+                          for job in critical],
+        'throughput_jobs_per_s': len(order) / makespan if makespan else 0.0,
+        'rules': rules,
+        'job_results': [{'rule': job.name, 'wildcards': dict(job.wildcards), **results[job]}
+                        for job in order],
+    }
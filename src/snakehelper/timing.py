@@ -0,0 +1,85 @@
+"""Wall time and call counts of the phases of a ``getSnake`` call.
+
+Every ``getSnake`` call records how long each phase took: importing
+Snakemake, parsing the Snakefile, building the DAG, the retry after a
+``MissingInputException``, selecting the job, creating folders, and so
+on. The returned snake object (``return_snake_obj=True``) carries the
+``PhaseTimer`` as its ``timing`` attribute. When ``$SNAKEHELPER_TIMING_FILE``
+is set, or ``timing_file`` is passed to ``getSnake``, one JSON object per
+call is appended to that file so latency can be tracked across workflows.
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+TIMING_FILE_ENV = 'SNAKEHELPER_TIMING_FILE'
+
+
+class PhaseStats:
+    """Accumulated wall time and number of calls of one phase."""
+
+    __slots__ = ('seconds', 'calls')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+
+    def __repr__(self):
+        return f'PhaseStats(seconds={self.seconds:.6f}, calls={self.calls})'
+
+
+class PhaseTimer:
+    """Records wall time and call counts per named phase.
+
+    Phases may nest; the time of an inner phase is also part of the outer
+    phase. ``phases`` keeps the order in which phases were first entered.
+    """
+
+    def __init__(self):
+        self.phases = {}  # name -> PhaseStats
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as one call of phase ``name``."""
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = PhaseStats()
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats.seconds += time.perf_counter() - start
+            stats.calls += 1
+
+    @property
+    def total(self):
+        """Seconds since the timer was created."""
+        return time.perf_counter() - self._started
+
+    def to_dict(self):
+        """Return the recorded phases as a JSON-friendly dict."""
+        return {
+            'total_s': self.total,
+            'phases': {name: {'seconds': s.seconds, 'calls': s.calls}
+                       for name, s in self.phases.items()},
+        }
+
+    def write_trace(self, path, **context):
+        """Append the recorded phases and ``context`` as one JSON line to ``path``."""
+        record = {'timestamp': time.time(), 'pid': os.getpid(), **context, **self.to_dict()}
+        with open(path, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+    def __repr__(self):
+        phases = ', '.join(f'{name}={s.seconds:.3f}s/{s.calls}' for name, s in self.phases.items())
+        return f'PhaseTimer({phases})'
+
+
+def get_timing_file(timing_file=None):
+    """Return the trace file to use, falling back to ``$SNAKEHELPER_TIMING_FILE``."""
+    if timing_file is None:
+        timing_file = os.environ.get(TIMING_FILE_ENV) or None
+    return timing_file
@@ -0,0 +1,192 @@
+"""Keep a compiled workflow up to date by watching its source files.
+
+A ``WorkflowWatcher`` compiles the workflow once and then watches the
+Snakefile, its included files and config files. When one of them changes the
+workflow is recompiled on a background thread, so the next ``getSnake`` call
+gets a fresh result without waiting for the compile.
+
+Changes are detected with inotify when the optional ``inotify_simple``
+package is installed, and by polling mtimes otherwise.
+"""
+
+import os
+import threading
+
+from .cache import _fingerprint
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+class _PollingBackend:
+    """Detect changes by comparing mtimes and sizes at a fixed interval."""
+
+    def __init__(self, paths, interval, baseline=None):
+        self.paths = list(paths)
+        self.interval = interval
+        self._fp = _fingerprint(self.paths) if baseline is None else baseline
+
+    def wait(self, stop_event):
+        """Block until a file changed (True) or ``stop_event`` is set (False)."""
+        while not stop_event.wait(self.interval):
+            fp = _fingerprint(self.paths)
+            if fp != self._fp:
+                self._fp = fp
+                return True
+        return False
+
+    def close(self):
+        pass
+
+
+class _InotifyBackend:
+    """Detect changes with inotify watches on the parent directories.
+
+    Directories rather than files are watched so that editors which save by
+    writing a new file and renaming it over the old one are detected too.
+    """
+
+    def __init__(self, paths, interval, baseline=None):
+        from inotify_simple import INotify, flags
+
+        self.interval = interval
+        self._inotify = INotify()
+        self._names = {}  # watch descriptor -> names of watched files in that directory
+        mask = flags.CLOSE_WRITE | flags.MODIFY | flags.MOVED_TO | flags.CREATE | flags.DELETE
+        for p in paths:
+            directory, name = os.path.split(p)
+            wd = self._inotify.add_watch(directory or '.', mask)
+            self._names.setdefault(wd, set()).add(name)
+
+    def wait(self, stop_event):
+        while not stop_event.is_set():
+            events = self._inotify.read(timeout=int(self.interval * 1000))
+            if any(e.name in self._names.get(e.wd, ()) for e in events):
+                # Coalesce the burst of events a single save usually produces
+                while self._inotify.read(timeout=50):
+                    pass
+                return True
+        return False
+
+    def close(self):
+        self._inotify.close()
+
+
+def _make_backend(paths, interval, baseline=None):
+    """Return a backend; ``baseline`` is the ``_fingerprint`` that polling compares against."""
+    try:
+        return _InotifyBackend(paths, interval)
+    except (ImportError, OSError):
+        return _PollingBackend(paths, interval, baseline)
+
+
+class WorkflowWatcher:
+    """Compiled workflow that is recompiled in the background when its sources change.
+
+    Args:
+        snakefile (str): Snakefile location
+        targets (list): Target files
+        interval (float): Polling interval in seconds
+        **parser_options: Keyword arguments passed to ``IOParser``
+    """
+
+    def __init__(self, snakefile, targets, interval=0.5, **parser_options):
+        self.snakefile = snakefile
+        self.targets = list(targets)
+        self.parser_options = parser_options
+        self.interval = interval
+        self.compile_count = 0
+        self._parser = None
+        self._error = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._compile()
+        self._thread = threading.Thread(target=self._run, name='snakehelper-watch', daemon=True)
+        self._thread.start()
+
+    def _compile(self):
+        from .SnakeIOHelper import IOParser
+
+        # Files that change from this snapshot on are compared against it, so
+        # a file that stays missing, or has an mtime ahead of our clock, counts once
+        self._compile_fp = {p: (p, mtime, size)
+                            for p, mtime, size in _fingerprint(self._sources())}
+        try:
+            parser = IOParser(self.snakefile, self.targets, **self.parser_options)
+            if self._parser is not None:
+                self._parser.close()  # frees its captured stderr text; still usable
+            self._parser = parser
+            self._error = None
+        except Exception as e:
+            self._error = e
+        # Sources found by this compile are compared against their state right after it
+        new = [p for p in self._sources() if p not in self._compile_fp]
+        self._compile_fp.update((p, (p, mtime, size)) for p, mtime, size in _fingerprint(new))
+        self.compile_count += 1
+        self._ready.set()
+
+    def _sources(self):
+        sources = [self.snakefile]
+        if self._parser is not None:
+            sources += self._parser.source_files
+        return list(dict.fromkeys(os.path.abspath(p) for p in sources))
+
+    def _baseline(self, paths):
+        """Return the fingerprint of ``paths`` as of the last compile, and the current one."""
+        current = _fingerprint(paths)
+        return tuple(self._compile_fp.get(entry[0], entry) for entry in current), current
+
+    def _run(self):
+        while not self._stop.is_set():
+            sources = self._sources()
+            baseline, current = self._baseline(sources)
+            backend = _make_backend(sources, self.interval, baseline)
+            try:
+                if self._error is not None:
+                    # Retrying a failed compile before a source changes would fail again
+                    changed = backend.wait(self._stop)
+                else:
+                    # Catch edits made while the previous compile was running
+                    changed = current != baseline or backend.wait(self._stop)
+            finally:
+                backend.close()
+            if changed and not self._stop.is_set():
+                self._ready.clear()
+                self._compile()
+
+    @property
+    def parser(self):
+        """The most recent compiled ``IOParser``.
+
+        Waits for a recompile that is already in progress. Raises the
+        compilation error if the latest compile failed.
+        """
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self._parser
+
+    def stop(self):
+        """Stop watching. The last compiled parser stays available."""
+        self._stop.set()
+        self._thread.join(timeout=self.interval + 1)
+
+
+def get_watcher(snakefile, targets, **parser_options):
+    """Return the watcher for a workflow, starting one if needed."""
+    key = (os.path.abspath(snakefile), tuple(str(t) for t in targets), os.getcwd(),
+           tuple(sorted(parser_options.items())))
+    with _watchers_lock:
+        watcher = _watchers.get(key)
+        if watcher is None:
+            watcher = _watchers[key] = WorkflowWatcher(snakefile, targets, **parser_options)
+        return watcher
+
+
+def stop_all():
+    """Stop and forget all watchers started by ``get_watcher``."""
+    with _watchers_lock:
+        watchers = list(_watchers.values())
+        _watchers.clear()
+    for watcher in watchers:
+        watcher.stop()
@@ -7,4 +7,29 @@
     https://pytest.org/latest/plugins.html
 """
 
-# import pytest
+import shutil
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture
+def workflow_copy(tmp_path):
+    """A private copy of the common workflow that tests can edit."""
+    shutil.copytree('tests/make_files', tmp_path / 'make_files')
+    shutil.copytree('tests/scripts', tmp_path / 'scripts')
+    return tmp_path / 'make_files' / 'workflow_common.smk'
+
+
+@pytest.fixture
+def deep_workflow(tmp_path, monkeypatch):
+    """Absolute path of the multi-step workflow, run from ``tmp_path`` as working directory."""
+    snakefile = str(Path(__file__).parent.absolute() / 'make_files' / 'workflow_deep.smk')
+    monkeypatch.chdir(tmp_path)
+    return snakefile
+
+
+@pytest.fixture(autouse=True)
+def private_code_cache(tmp_path, monkeypatch):
+    """Keep the on-disk code cache of each test out of the real home directory."""
+    monkeypatch.setenv('SNAKEHELPER_CODE_CACHE', str(tmp_path / 'code_cache'))
@@ -0,0 +1,31 @@
+
+rule raw_to_filtered:
+    input:
+        raw = '{recording}/raw.dat'
+    output:
+        filtered = '{recording}/processed/filtered.dat'
+    log:
+        '{recording}/processed/filter.log'
+    shell:
+        'cp {input} {output}'
+
+rule filtered_to_sorted:
+    input:
+        filtered = '{recording}/processed/filtered.dat'
+    output:
+        sorted = '{recording}/processed/sorted.pkl'
+    shell:
+        'cp {input} {output}'
+
+rule sorted_to_curated:
+    input:
+        sorted = '{recording}/processed/sorted.pkl',
+        params_file = lambda wildcards: f'{wildcards.recording}/curation_params.json'
+    output:
+        curated = '{recording}/processed/curated.pkl'
+    params:
+        threshold = 0.5
+    log:
+        '{recording}/processed/curate.log'
+    shell:
+        'cp {input.sorted} {output}'
@@ -0,0 +1,32 @@
+# Script used by test_multiprocess_logging: workers of fork and spawn pools log to the rule's log file
+# Usage: multiprocess.py LOG_FILE [WORKERS]; each pool runs WORKERS processes (default 32)
+# and logs 2 * WORKERS records from each pool
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from loguru import logger
+
+from snakehelper.SnakeIOHelper import getSnake, init_worker_logging
+
+
+def work(i):
+    logger.info(f'worker record {i}')
+    print(f'worker stderr {i}', file=sys.stderr)
+    return i
+
+
+if __name__ == '__main__':
+    log_file = sys.argv[1]
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    tasks = 2 * workers
+    snake = type('FakeSnakemake', (), {'input': [], 'output': [], 'log': [log_file]})()
+    getSnake({'snakemake': snake}, '', [], '', multiprocess_logging=True)
+
+    with multiprocessing.get_context('fork').Pool(workers) as pool:
+        pool.map(work, range(tasks), chunksize=1)
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=init_worker_logging,
+                             initargs=(logger,)) as pool:
+        list(pool.map(work, range(tasks, 2 * tasks)))
+    logger.info('parent done')
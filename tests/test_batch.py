@@ -0,0 +1,42 @@
+from snakehelper.batch import resolve_many
+
+
+def _make_raw(root, recordings):
+    for rec in recordings:
+        (root / rec).mkdir()
+        (root / rec / 'raw.dat').touch()
+        (root / rec / 'curation_params.json').touch()
+
+
+def test_resolve_many_single_compile(tmp_path, deep_workflow):
+    recordings = ['rec1', 'rec2', 'rec3']
+    _make_raw(tmp_path, recordings)
+
+    results = resolve_many(deep_workflow, [f'{r}/processed/curated.pkl' for r in recordings])
+
+    assert len(results) == 9  # three rules per recording
+    record = results[('raw_to_filtered', (('recording', 'rec2'),))]
+    assert record.input.raw == 'rec2/raw.dat'
+    assert record.log[0] == 'rec2/processed/filter.log'
+
+
+def test_resolve_many_stat_free_without_raw_inputs(tmp_path, deep_workflow):
+    results = resolve_many(deep_workflow, ['rec1/processed/curated.pkl'], stat_free=True)
+
+    assert results[('raw_to_filtered', (('recording', 'rec1'),))].input.raw == 'rec1/raw.dat'
+    assert not (tmp_path / 'rec1').exists()
+
+
+def test_resolve_many_sharded_over_processes(deep_workflow):
+    recordings = [f'rec{i}' for i in range(6)]
+    targets = [f'{r}/processed/curated.pkl' for r in recordings]
+
+    serial = resolve_many(deep_workflow, targets, rules=['sorted_to_curated'], pruned=True)
+    sharded = resolve_many(deep_workflow, targets, rules=['sorted_to_curated'], pruned=True,
+                           processes=2)
+
+    assert set(serial) == set(sharded) == {
+        ('sorted_to_curated', (('recording', r),)) for r in recordings}
+    for key, record in serial.items():
+        assert list(sharded[key].input) == list(record.input)
+        assert sharded[key].params.threshold == 0.5
@@ -0,0 +1,337 @@
+import shutil
+from pathlib import Path
+
+import snakehelper.SnakeIOHelper as mod
+from snakehelper.SnakeIOHelper import getSnake
+from snakehelper.resolved import ResolvedIO
+
+
+def test_disk_cache_hit_skips_snakemake(tmp_path, workflow_copy, monkeypatch):
+    cache_dir = tmp_path / 'cache'
+    args = (str(workflow_copy), ['tests/processed/recording_info.pkl'], 'sort_spikes')
+
+    sinput, soutput = getSnake({}, *args, change_working_dir=False, createFolder=False,
+                               cache_dir=cache_dir)
+    assert any(cache_dir.glob('*/*.pkl'))
+
+    def fail(*_args, **_kwargs):
+        raise AssertionError('IOParser should not be built on a cache hit')
+
+    monkeypatch.setattr(mod, 'IOParser', fail)
+    sinput2, soutput2, obj = getSnake({}, *args, change_working_dir=False, createFolder=False,
+                                      cache_dir=cache_dir, return_snake_obj=True)
+
+    assert isinstance(obj, ResolvedIO)
+    assert obj.name == 'sort_spikes'
+    assert sinput2.recording_to_sort == sinput.recording_to_sort == 'tests'
+    assert Path(soutput2.recording_info) == Path(str(soutput.recording_info))
+    assert obj.log[0] == 'tests/processed/snakemake.log'
+
+
+def test_disk_cache_invalidated_by_snakefile_edit(tmp_path, workflow_copy):
+    cache_dir = tmp_path / 'cache'
+    args = (str(workflow_copy), ['tests/processed/recording_info.pkl'], 'sort_spikes')
+    getSnake({}, *args, change_working_dir=False, createFolder=False, cache_dir=cache_dir)
+
+    workflow_copy.write_text(workflow_copy.read_text().replace('snakemake.log', 'edited.log'))
+    _, _, obj = getSnake({}, *args, change_working_dir=False, createFolder=False,
+                         cache_dir=cache_dir, return_snake_obj=True)
+
+    assert not isinstance(obj, ResolvedIO)
+    assert str(obj.log[0]) == 'tests/processed/edited.log'
+
+
+def test_parser_cache_reuses_and_invalidates(workflow_copy):
+    from snakehelper.cache import parser_cache
+
+    parser_cache.clear()
+    args = (str(workflow_copy), ['tests/processed/recording_info.pkl'], 'sort_spikes')
+    _, _, job1 = getSnake({}, *args, change_working_dir=False, createFolder=False,
+                          return_snake_obj=True)
+    _, _, job2 = getSnake({}, *args, change_working_dir=False, createFolder=False,
+                          return_snake_obj=True)
+    assert job1 is job2
+    assert parser_cache.stats()['hits'] == 1
+
+    workflow_copy.write_text(workflow_copy.read_text() + '\n# edited\n')
+    _, _, job3 = getSnake({}, *args, change_working_dir=False, createFolder=False,
+                          return_snake_obj=True)
+    assert job3 is not job1
+    assert parser_cache.stats()['size'] == 1
+
+
+def test_parser_cache_evicts_least_recently_used():
+    from snakehelper.cache import ParserCache
+
+    class FakeParser:
+        source_files = []
+
+    cache = ParserCache(maxsize=2)
+    smk = 'tests/make_files/workflow_common.smk'
+    parsers = [FakeParser() for _ in range(3)]
+    for i, p in enumerate(parsers):
+        cache.put(smk, [f'target{i}'], p)
+
+    assert cache.get(smk, ['target0']) is None
+    assert cache.get(smk, ['target2']) is parsers[2]
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 1, 'size': 2, 'maxsize': 2}
+
+
+def test_resolved_record_keeps_directory_outputs():
+    import pickle
+
+    from snakemake.io import AnnotatedString, directory
+    try:
+        from snakemake.io import Namedlist
+    except ImportError:  # moved to snakemake.iocontainers in Snakemake 9.20
+        from snakemake.iocontainers import Namedlist
+
+    from snakehelper.resolved import NamedPaths
+
+    paths = NamedPaths.from_namedlist(Namedlist([directory('out_dir'), AnnotatedString('out_file')]))
+    for copy in (pickle.loads(pickle.dumps(paths)), NamedPaths.from_dict(paths.to_dict())):
+        assert copy == ['out_dir', 'out_file']
+        assert copy[0].flags == {'directory': True}
+        assert copy[1].flags == {}
+
+
+def _single_flight_worker(cache_dir, snakefile, counter):
+    import os
+    import time
+
+    from snakehelper.cache import ResultCache
+    from snakehelper.resolved import NamedPaths
+
+    cache = ResultCache(cache_dir)
+    record, lock = cache.acquire(snakefile, ['out.txt'], 'rule_a', poll_interval=0.02)
+    if lock is not None:
+        with open(counter, 'a') as f:
+            f.write(f'{os.getpid()}\n')
+        time.sleep(0.5)  # a slow compile
+        record = ResolvedIO('rule_a', NamedPaths(), NamedPaths(['out.txt']), NamedPaths(),
+                            NamedPaths(), NamedPaths())
+        cache.put(snakefile, ['out.txt'], 'rule_a', record)
+        lock.release()
+    return record.output[0]
+
+
+def test_disk_cache_single_flight_across_processes(tmp_path):
+    from concurrent.futures import ProcessPoolExecutor
+
+    snakefile = tmp_path / 'Snakefile'
+    snakefile.write_text('rule a:\n    output: "out.txt"\n')
+    counter = tmp_path / 'computed'
+    with ProcessPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(_single_flight_worker, [str(tmp_path / 'cache')] * 8,
+                                [str(snakefile)] * 8, [str(counter)] * 8))
+
+    assert results == ['out.txt'] * 8
+    assert len(counter.read_text().splitlines()) == 1
+    assert not list((tmp_path / 'cache').glob('*/*.lock'))
+
+
+def test_stale_cache_locks_are_broken(tmp_path):
+    import json
+    import os
+    import socket
+    import subprocess
+    import sys
+
+    from snakehelper.cache import ResultCache
+
+    snakefile = tmp_path / 'Snakefile'
+    snakefile.write_text('rule a:\n    output: "out.txt"\n')
+    cache = ResultCache(tmp_path / 'cache', stale_after=60)
+    lock_path = cache._path(cache.key(snakefile, ['out.txt'], 'rule_a')).with_suffix('.lock')
+    lock_path.parent.mkdir(parents=True)
+
+    # Owner process on this host has exited
+    dead = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                          capture_output=True, text=True).stdout.strip()
+    lock_path.write_text(json.dumps({'host': socket.gethostname(), 'pid': int(dead)}))
+    record, lock = cache.acquire(snakefile, ['out.txt'], 'rule_a', wait_timeout=5)
+    assert record is None and lock is not None
+    lock.release()
+
+    # Owner on another node that stopped refreshing the lock
+    lock_path.write_text(json.dumps({'host': 'other-node', 'pid': 1}))
+    os.utime(lock_path, (0, 0))
+    record, lock = cache.acquire(snakefile, ['out.txt'], 'rule_a', wait_timeout=5)
+    assert lock is not None
+    lock.release()
+
+    # A live lock is waited for until the timeout
+    lock_path.write_text(json.dumps({'host': 'other-node', 'pid': 1}))
+    record, lock = cache.acquire(snakefile, ['out.txt'], 'rule_a', wait_timeout=0.1,
+                                 poll_interval=0.02)
+    assert record is None and lock is None
+
+
+def test_code_cache_skips_translation_for_new_targets(tmp_path, workflow_copy, monkeypatch):
+    from snakehelper import _codecache
+    from snakehelper.SnakeIOHelper import IOParser
+
+    monkeypatch.setenv(_codecache.CODE_CACHE_ENV, str(tmp_path / 'code'))
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(workflow_copy.parent / 'workflow_deep.smk', tmp_path / 'Snakefile')
+    _codecache.clear()
+
+    def build(recording, final='curated.pkl'):
+        parser = IOParser('Snakefile', [f'{recording}/processed/{final}'], virtual_inputs=True)
+        return {job.name: str(job.output[0]) for job in parser.dag.jobs}
+
+    before = _codecache.stats()
+    assert build('rec0')['raw_to_filtered'] == 'rec0/processed/filtered.dat'
+    assert _codecache.stats()['misses'] == before['misses'] + 1
+    assert any((tmp_path / 'code').glob('*/*.marshal'))
+
+    assert build('rec1')['sorted_to_curated'] == 'rec1/processed/curated.pkl'
+    assert _codecache.stats()['memory_hits'] == before['memory_hits'] + 1
+
+    _codecache.clear()  # as in a new process, only the files on disk remain
+    assert build('rec2')['filtered_to_sorted'] == 'rec2/processed/sorted.pkl'
+    assert _codecache.stats()['disk_hits'] == before['disk_hits'] + 1
+
+    snakefile = tmp_path / 'Snakefile'
+    snakefile.write_text(snakefile.read_text().replace('curated.pkl', 'final.pkl'))
+    assert build('rec3', 'final.pkl')['sorted_to_curated'] == 'rec3/processed/final.pkl'
+    assert _codecache.stats()['misses'] == before['misses'] + 2
+
+
+def test_code_cache_memory_is_bounded(tmp_path, workflow_copy, monkeypatch):
+    from snakehelper import _codecache
+    from snakehelper.SnakeIOHelper import IOParser
+
+    monkeypatch.setattr(_codecache, 'MAX_ENTRIES', 1)
+    monkeypatch.chdir(tmp_path)
+    snakefile = tmp_path / 'Snakefile'
+    source = (workflow_copy.parent / 'workflow_deep.smk').read_text()
+    _codecache.clear()
+
+    for final in ('curated.pkl', 'final.pkl', 'last.pkl'):
+        snakefile.write_text(source.replace('curated.pkl', final))
+        IOParser('Snakefile', [f'rec0/processed/{final}'], virtual_inputs=True)
+        assert len(_codecache._entries) <= 1 and len(_codecache._compiled) <= 1
+
+
+def test_unusable_cache_dir_falls_back_to_compiling(tmp_path, workflow_copy):
+    blocker = tmp_path / 'not_a_directory'
+    blocker.write_text('')
+    args = (str(workflow_copy), ['tests/processed/recording_info.pkl'], 'sort_spikes')
+
+    sinput, soutput = getSnake({}, *args, change_working_dir=False, createFolder=False,
+                               memory_cache=False, use_daemon=False, cache_dir=blocker / 'cache')
+
+    assert sinput.recording_to_sort == 'tests'
+
+
+def test_waiters_fail_fast_when_the_lock_owner_fails(tmp_path):
+    import threading
+    import time
+
+    from snakehelper.cache import ResolutionFailed, ResultCache
+
+    snakefile = tmp_path / 'Snakefile'
+    snakefile.write_text('rule a:\n    output: "out.txt"\n')
+    cache = ResultCache(tmp_path / 'cache')
+    args = (snakefile, ['out.txt'], 'rule_a')
+    record, owner = cache.acquire(*args)
+    assert owner is not None
+
+    errors = []
+
+    def wait():
+        try:
+            cache.acquire(*args, wait_timeout=30, poll_interval=0.02)
+        except ResolutionFailed as e:
+            errors.append(str(e))
+
+    waiters = [threading.Thread(target=wait) for _ in range(4)]
+    for t in waiters:
+        t.start()
+    time.sleep(0.2)
+    cache.put_failure(*args, owner, KeyError('sort_spikes'))
+    owner.release()
+    for t in waiters:
+        t.join(timeout=10)
+
+    assert errors == ["KeyError: 'sort_spikes'"] * 4
+    assert not list((tmp_path / 'cache').glob('*/*.lock'))
+
+    # A later resolution is not affected by the failure of an earlier one
+    record, lock = cache.acquire(*args, wait_timeout=0)
+    assert record is None and lock is not None
+    lock.release()
+
+
+def test_breaking_a_stale_lock_spares_newer_locks(tmp_path):
+    import json
+    import os
+
+    from snakehelper.cache import KeyLock
+
+    path = tmp_path / 'entry.lock'
+    path.write_text(json.dumps({'host': 'other-node', 'pid': 1}))
+    os.utime(path, (0, 0))
+    judge = KeyLock(path, stale_after=60)
+    state = judge.stale_state()
+    assert state is not None
+
+    # Another process breaks the stale lock first and a third one takes a fresh lock
+    judge.break_stale(state)
+    owner = KeyLock(path, stale_after=60)
+    assert owner.try_acquire()
+    judge.break_stale(state)
+    assert path.exists()
+
+    # A lock taken over by another process is not removed by the old owner's release
+    path.unlink()
+    newer = KeyLock(path, stale_after=60)
+    assert newer.try_acquire()
+    owner.release()
+    assert path.exists()
+    newer.release()
+    assert not path.exists()
+    assert not list(tmp_path.glob('*.stale-*'))
+
+
+def test_failed_cache_write_keeps_the_resolution(tmp_path, workflow_copy, monkeypatch):
+    from snakehelper.cache import ResultCache
+
+    def put(*_args, **_kwargs):
+        raise PermissionError('read-only cache')
+
+    monkeypatch.setattr(ResultCache, 'put', put)
+    args = (str(workflow_copy), ['tests/processed/recording_info.pkl'], 'sort_spikes')
+    sinput, soutput = getSnake({}, *args, change_working_dir=False, createFolder=False,
+                               memory_cache=False, use_daemon=False, cache_dir=tmp_path / 'cache')
+
+    assert sinput.recording_to_sort == 'tests'
+    assert not list((tmp_path / 'cache').glob('*/*.lock'))
+
+
+def test_compact_records_do_not_keep_the_workflow_alive(workflow_copy, monkeypatch):
+    import gc
+    import weakref
+
+    import snakemake.api  # noqa: F401  a first import keeps the importing frames alive
+
+    from snakehelper.cache import parser_cache
+
+    parsers = []
+
+    class TrackedParser(mod.IOParser):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            parsers.append(weakref.ref(self))
+
+    monkeypatch.setattr(mod, 'IOParser', TrackedParser)
+    parser_cache.clear()
+    args = (str(workflow_copy), ['tests/processed/recording_info.pkl'], 'sort_spikes')
+    _, _, record = getSnake({}, *args, change_working_dir=False, createFolder=False,
+                            use_daemon=False, return_snake_obj=True, compact=True)
+
+    assert isinstance(record, ResolvedIO)
+    assert parser_cache.stats()['size'] == 0
+    gc.collect()
+    assert len(parsers) == 1 and parsers[0]() is None
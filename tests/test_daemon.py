@@ -0,0 +1,95 @@
+import threading
+from pathlib import Path
+
+import pytest
+
+import snakehelper.SnakeIOHelper as mod
+from snakehelper import daemon, main
+from snakehelper.SnakeIOHelper import getSnake
+from snakehelper.resolved import ResolvedIO
+
+
+@pytest.fixture
+def resolver(tmp_path, monkeypatch):
+    socket_path = str(tmp_path / 'resolver.sock')
+    monkeypatch.setenv(daemon.SOCKET_ENV, socket_path)
+    server = daemon.ResolverServer(socket_path)
+    thread = threading.Thread(target=server.serve_until_shutdown, daemon=True)
+    thread.start()
+    yield socket_path
+    if thread.is_alive():
+        main(['stop', '--socket', socket_path])
+        thread.join(timeout=10)
+
+
+def test_getSnake_uses_running_daemon(resolver, monkeypatch):
+    def fail(*_args, **_kwargs):
+        raise AssertionError('IOParser should not be built when the daemon answers')
+
+    record = daemon.query('tests/make_files/workflow_common.smk',
+                          ['tests/processed/recording_info.pkl'], 'sort_spikes')
+    assert isinstance(record, ResolvedIO)
+
+    args = ({}, 'tests/make_files/workflow_common.smk', ['tests/processed/recording_info.pkl'],
+            'sort_spikes')
+    options = dict(change_working_dir=False, createFolder=False, memory_cache=False)
+    # A Snakemake Job is only available from a local compile
+    _in, _out, job = getSnake(*args, return_snake_obj=True, **options)
+    assert not isinstance(job, ResolvedIO)
+
+    monkeypatch.setattr(mod, 'IOParser', fail)
+    sinput, soutput = getSnake(*args, **options)
+    assert sinput.recording_to_sort == 'tests'
+    assert Path(soutput.recording_info) == Path('tests/processed/recording_info.pkl')
+
+    _in, _out, obj = getSnake(*args, return_snake_obj=True, compact=True, **options)
+    assert isinstance(obj, ResolvedIO)
+
+
+def test_daemon_errors_fall_back_to_local_resolution(resolver):
+    assert daemon.query('tests/make_files/workflow_common.smk',
+                        ['tests/processed/recording_info.pkl'], 'nonexistent_rule') is None
+    with pytest.raises(KeyError):
+        getSnake({}, 'tests/make_files/workflow_common.smk',
+                 ['tests/processed/recording_info.pkl'], 'nonexistent_rule',
+                 change_working_dir=False, createFolder=False)
+
+
+def test_stop_removes_socket(resolver):
+    assert main(['stop', '--socket', resolver]) == 0
+    for _ in range(100):
+        if not Path(resolver).exists():
+            break
+        threading.Event().wait(0.05)
+    assert not Path(resolver).exists()
+    assert daemon.query('tests/make_files/workflow_common.smk', [], 'sort_spikes') is None
+
+
+def test_busy_daemon_socket_is_not_removed(tmp_path):
+    import socket
+
+    socket_path = str(tmp_path / 'busy.sock')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as busy:
+        busy.bind(socket_path)
+        busy.listen()  # accepts connections but never replies, like a daemon compiling
+        with pytest.raises(RuntimeError):
+            daemon.ResolverServer(socket_path)
+        assert Path(socket_path).exists()
+
+    # Nobody listens any more: the socket is stale and replaced
+    server = daemon.ResolverServer(socket_path)
+    server.server_close()
+
+
+def test_idle_connections_are_dropped(tmp_path):
+    import socket
+
+    socket_path = str(tmp_path / 'resolver.sock')
+    server = daemon.ResolverServer(socket_path, connection_timeout=0.2)
+    thread = threading.Thread(target=server.serve_until_shutdown, daemon=True)
+    thread.start()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as idle:
+        idle.connect(socket_path)
+        assert daemon.request({'op': 'ping'}, socket_path, timeout=5)['ok']
+    daemon.request({'op': 'shutdown'}, socket_path, timeout=5)
+    thread.join(timeout=10)
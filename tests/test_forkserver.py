@@ -0,0 +1,62 @@
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from snakehelper import forkserver
+
+_SCRIPT = '''
+import sys
+from snakehelper.cache import parser_cache
+from snakehelper.SnakeIOHelper import getSnake
+
+sinput, soutput = getSnake(locals(), 'tests/make_files/workflow_common.smk',
+                           ['tests/processed/recording_info.pkl'], 'sort_spikes',
+                           change_working_dir=False, createFolder=False, use_daemon=False)
+print(sinput.recording_to_sort, parser_cache.stats()['hits'], sys.argv[1:])
+sys.exit(3)
+'''
+
+
+@pytest.fixture
+def server(tmp_path):
+    socket_path = str(tmp_path / 'fork.sock')
+    proc = subprocess.Popen([
+        sys.executable, '-c', 'import sys; from snakehelper import main; sys.exit(main(sys.argv[1:]))',
+        'forkserver', '--socket', socket_path, '--snakefile', 'tests/make_files/workflow_common.smk',
+        '--targets', 'tests/processed/recording_info.pkl'])
+    for _ in range(600):
+        if Path(socket_path).exists() or proc.poll() is not None:
+            break
+        time.sleep(0.05)
+    assert Path(socket_path).exists()
+    yield socket_path
+    if proc.poll() is None:
+        forkserver.stop(socket_path)
+        proc.wait(timeout=10)
+
+
+def test_launch_runs_script_with_preloaded_workflow(server, tmp_path):
+    script = tmp_path / 'script.py'
+    script.write_text(_SCRIPT)
+
+    result = subprocess.run([
+        sys.executable, '-c', 'import sys; from snakehelper import main; sys.exit(main(sys.argv[1:]))',
+        'launch', '--socket', server, str(script), '--flag', 'x'], capture_output=True, text=True)
+
+    assert result.returncode == 3
+    # The compiled workflow was inherited from the server: the lookup is a cache hit
+    assert result.stdout.strip() == "tests 1 ['--flag', 'x']"
+
+
+def test_stop_removes_socket(server):
+    forkserver.stop(server)
+    for _ in range(100):
+        if not Path(server).exists():
+            break
+        time.sleep(0.05)
+    assert not Path(server).exists()
+    with pytest.raises(OSError):
+        forkserver.launch(['script.py'], server)
@@ -0,0 +1,48 @@
+import subprocess
+import sys
+
+import pytest
+
+from snakehelper import main
+from snakehelper.indexfile import IndexFile, get_snake
+
+
+def test_index_lookup_by_task_and_wildcards(monkeypatch, deep_workflow):
+    targets = [f'rec{i}/processed/curated.pkl' for i in (2, 0, 1)]
+
+    assert main(['index', '--snakefile', deep_workflow, '--rule', 'sorted_to_curated',
+                 '--targets', *targets, '--output', 'jobs.idx', '--virtual-inputs']) == 0
+
+    with IndexFile('jobs.idx') as index:
+        assert len(index) == 3
+        assert [index[i].wildcards.recording for i in range(3)] == ['rec2', 'rec0', 'rec1']
+        record = index.get(recording='rec1')
+        assert record.output[0] == 'rec1/processed/curated.pkl'
+        assert record.input.params_file == 'rec1/curation_params.json'
+        assert record.params.threshold == 0.5
+        with pytest.raises(KeyError):
+            index.get(recording='missing')
+        with pytest.raises(IndexError):
+            index[3]
+
+    monkeypatch.setenv('SLURM_ARRAY_TASK_ID', '1')
+    sinput, soutput = get_snake({}, 'jobs.idx', createFolder=False)
+    assert soutput[0] == 'rec0/processed/curated.pkl'
+
+
+def test_index_reader_does_not_import_snakemake(tmp_path):
+    from snakehelper.indexfile import write_index
+    from snakehelper.resolved import NamedPaths, ResolvedIO
+
+    record = ResolvedIO('rule_a', NamedPaths(['in.txt']), NamedPaths(['out.txt']), NamedPaths(),
+                        NamedPaths(), NamedPaths(['x'], {'sample': (0, None)}))
+    write_index(tmp_path / 'jobs.idx', [record])
+    probe = (
+        "import sys\n"
+        "from snakehelper.indexfile import IndexFile\n"
+        f"print(IndexFile({str(tmp_path / 'jobs.idx')!r}).get(sample='x').output[0])\n"
+        "print('snakemake' in sys.modules)\n"
+    )
+    out = subprocess.run([sys.executable, '-c', probe], check=True, capture_output=True,
+                         text=True).stdout
+    assert out.split() == ['out.txt', 'False']
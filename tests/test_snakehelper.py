@@ -6,6 +6,7 @@ import glob
 import pytest
 from snakehelper.SnakeIOHelper import getSnake
 import subprocess
+import sys
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -298,3 +299,460 @@ def test_cli_execution_normal_logfile():
 
     if expected_log_file.exists():
         expected_log_file.unlink()
+
+
+def test_pruned_dag_matches_full_dag(tmp_path, deep_workflow):
+    from snakehelper.SnakeIOHelper import IOParser
+
+    target = ['rec1/processed/curated.pkl']
+
+    pruned = IOParser(deep_workflow, target, rule='sorted_to_curated', pruned=True)
+    assert [j.name for j in pruned.dag.jobs] == ['sorted_to_curated']
+    # No placeholder inputs are created in pruned mode
+    assert not (tmp_path / 'rec1').exists()
+
+    (tmp_path / 'rec1').mkdir()
+    (tmp_path / 'rec1' / 'raw.dat').touch()
+    (tmp_path / 'rec1' / 'curation_params.json').touch()
+    full = IOParser(deep_workflow, target)
+    assert len(list(full.dag.jobs)) == 3
+
+    job_pruned = pruned.getInputOutput4rule('sorted_to_curated')
+    job_full = full.getInputOutput4rule('sorted_to_curated')
+    assert list(map(str, job_pruned.input)) == list(map(str, job_full.input))
+    assert job_pruned.input.params_file == 'rec1/curation_params.json'
+    assert job_pruned.params.threshold == 0.5
+    assert pruned.log_files['sorted_to_curated'] == 'rec1/processed/curate.log'
+
+
+def test_in_pipeline_path_does_not_import_snakemake():
+    # Import-time regression guard: see benchmarks/bench_import.py for timings
+    probe = (
+        "import sys\n"
+        "from types import SimpleNamespace\n"
+        "from snakehelper.SnakeIOHelper import getSnake\n"
+        "fake = SimpleNamespace(input=['in.txt'], output=['out.txt'], log=[])\n"
+        "getSnake({'snakemake': fake}, '', [], '', createFolder=False)\n"
+        "print(sorted({m.split('.')[0] for m in sys.modules} & {'snakemake', 'loguru'}))\n"
+    )
+    out = subprocess.run([sys.executable, '-c', probe], check=True,
+                         capture_output=True, text=True).stdout
+    assert out.strip() == '[]'
+
+
+def test_job_index_keeps_all_jobs_of_a_rule(deep_workflow):
+    from snakehelper.SnakeIOHelper import IOParser
+
+    targets = [f'rec{i}/processed/curated.pkl' for i in range(3)]
+    parser = IOParser(deep_workflow, targets, pruned=True)
+    index = parser.job_index
+
+    assert len(index.jobs_for_rule('sorted_to_curated')) == 3
+    job = index.get('sorted_to_curated', recording='rec1')
+    assert str(job.output[0]) == 'rec1/processed/curated.pkl'
+    assert index.find('sorted_to_curated', recording='rec2')[0].wildcards.recording == 'rec2'
+    assert index.producer('./rec0/processed/curated.pkl').wildcards.recording == 'rec0'
+    with pytest.raises(KeyError):
+        index.get('sorted_to_curated', recording='missing')
+
+    assert parser.getInputOutput4rule('sorted_to_curated', {'recording': 'rec0'}) is \
+        index.get('sorted_to_curated', recording='rec0')
+    # Without wildcards the job producing the first target is returned, without an index
+    parser = IOParser(deep_workflow, targets[::-1], pruned=True)
+    assert parser.getInputOutput4rule('sorted_to_curated').wildcards.recording == 'rec2'
+    assert parser._job_index is None
+
+
+def test_virtual_inputs_single_pass_without_placeholders(tmp_path, deep_workflow):
+    from snakehelper.SnakeIOHelper import IOParser
+
+    parser = IOParser(deep_workflow, ['rec1/processed/curated.pkl'], virtual_inputs=True)
+
+    assert sorted(j.name for j in parser.dag.jobs) == [
+        'filtered_to_sorted', 'raw_to_filtered', 'sorted_to_curated']
+    assert parser.missing_inputs == {'rec1/raw.dat', 'rec1/curation_params.json'}
+    assert not (tmp_path / 'rec1').exists()  # no placeholder files or folders
+    job = parser.getInputOutput4rule('raw_to_filtered')
+    assert job.input.raw == 'rec1/raw.dat'
+
+
+def test_make_folders_batches_and_respects_directory_flag(tmp_path, monkeypatch, capsys):
+    import snakehelper.SnakeIOHelper as mod
+    from snakemake.io import AnnotatedString, directory
+    try:
+        from snakemake.io import Namedlist
+    except ImportError:  # moved to snakemake.iocontainers in Snakemake 9.20
+        from snakemake.iocontainers import Namedlist
+
+    monkeypatch.chdir(tmp_path)
+    # Snakemake outputs carry flags, so a suffix-less file is not taken as a folder
+    files = [f'a/b{i}/out.txt' for i in range(5)] + ['a/b0/other.txt', 'noext_file']
+    outputs = Namedlist([AnnotatedString(f) for f in files] + [directory('dir_out')])
+    mod.makeFolders(outputs)
+
+    for i in range(5):
+        assert (tmp_path / 'a' / f'b{i}').is_dir()
+    assert (tmp_path / 'dir_out').is_dir()
+    assert not (tmp_path / 'noext_file').exists()
+    assert capsys.readouterr().out.count('\n') == 1  # a single summary line
+
+    # Known folders are not touched again
+    def fail(*_args, **_kwargs):
+        raise AssertionError('makedirs should not be called for known folders')
+
+    with monkeypatch.context() as m:
+        m.setattr(mod.os, 'makedirs', fail)
+        mod.makeFolders(outputs)
+
+    # A known folder deleted since, e.g. before re-running a notebook cell, is created again
+    shutil.rmtree(tmp_path / 'a')
+    mod.makeFolders(outputs)
+    assert (tmp_path / 'a' / 'b3').is_dir()
+
+
+class _ListLogger:
+    def __init__(self):
+        self.records = []
+
+    def error(self, text):
+        self.records.append(text)
+
+    def warning(self, text):
+        self.records.append('WARNING ' + text)
+
+
+def test_stream_to_logger_splits_lines_and_flushes():
+    from snakehelper.SnakeIOHelper import StreamToLogger
+
+    log = _ListLogger()
+    stream = StreamToLogger(log)
+    stream.write('first\nsecond\nthi')
+    stream.write('rd')
+    stream.flush()
+    assert log.records == ['first', 'second']
+
+    stream.write('\n  \nprogress 10%\rprogress 100%\r\n')
+    stream.write('partial')
+    stream.flush()
+    assert log.records == ['first', 'second', 'third', 'progress 100%']
+
+    stream.close()
+    assert log.records[-1] == 'partial'
+    stream.write('ignored after close\n')
+    assert log.records[-1] == 'partial'
+
+
+def test_stream_to_logger_bounded_queue_drops_and_reports():
+    import threading
+
+    from snakehelper.SnakeIOHelper import StreamToLogger
+
+    release = threading.Event()
+
+    class SlowLogger(_ListLogger):
+        def error(self, text):
+            release.wait()
+            super().error(text)
+
+    log = SlowLogger()
+    stream = StreamToLogger(log, max_queue=2)
+    stream.write(''.join(f'line {i}\n' for i in range(10)))
+    release.set()
+    stream.close()
+
+    assert stream.dropped > 0
+    assert len([r for r in log.records if not r.startswith('WARNING')]) == 10 - stream.dropped
+    assert log.records[-1].startswith(f'WARNING {stream.dropped} stderr messages were dropped')
+
+
+def test_multiprocess_logging_collects_worker_records(tmp_path):
+    log_file = tmp_path / 'rule.log'
+    subprocess.run([sys.executable, 'tests/scripts/multiprocess.py', str(log_file)], check=True,
+                   capture_output=True)
+
+    content = log_file.read_text()
+    for i in range(128):  # 32 workers per pool by default, two records per worker
+        assert f'worker record {i}\n' in content
+        assert f'worker stderr {i}\n' in content
+    assert 'parent done' in content
+
+
+def test_phase_timing_on_snake_obj_and_trace_file(tmp_path, monkeypatch, deep_workflow):
+    import json
+
+    trace = tmp_path / 'trace.jsonl'
+    monkeypatch.setenv('SNAKEHELPER_TIMING_FILE', str(trace))
+
+    _in, _out, job = getSnake({}, deep_workflow, ['rec1/processed/curated.pkl'],
+                              'sorted_to_curated', change_working_dir=False, return_snake_obj=True,
+                              memory_cache=False, use_daemon=False, virtual_inputs=True)
+
+    phases = job.timing.phases
+    for name in ('import_snakemake', 'parse', 'build_dag', 'select_job', 'make_folders',
+                 'prepare_logger'):
+        assert phases[name].calls == 1
+    assert 'missing_input_retry' not in phases
+    assert phases['parse'].seconds > 0
+
+    record = json.loads(trace.read_text())
+    assert record['rule'] == 'sorted_to_curated'
+    assert record['phases']['build_dag']['calls'] == 1
+    assert record['total_s'] >= record['phases']['parse']['seconds']
+
+
+def test_compact_record_is_detached_and_picklable(deep_workflow):
+    import pickle
+    from snakehelper.resolved import ResolvedIO
+
+    sinput, soutput, record = getSnake({}, deep_workflow, ['rec1/processed/curated.pkl'],
+                                       'sorted_to_curated', change_working_dir=False,
+                                       createFolder=False, return_snake_obj=True,
+                                       use_daemon=False, virtual_inputs=True, compact=True)
+
+    assert isinstance(record, ResolvedIO)
+    assert not hasattr(record, '__dict__')
+    assert sinput is record.input and soutput is record.output
+    assert record.threads == 1
+    assert record.resources['_cores'] == 1
+    assert record.timing.phases['select_job'].calls == 1
+
+    copy = pickle.loads(pickle.dumps(record))
+    assert copy.input.params_file == 'rec1/curation_params.json'
+    assert copy.params.threshold == 0.5
+    assert copy.wildcards.recording == 'rec1'
+    assert copy.log[0] == 'rec1/processed/curate.log'
+    assert copy.resources.tmpdir == record.resources.tmpdir
+    assert copy.timing is None
+    assert ResolvedIO.from_dict(record.to_dict()).resources['_nodes'] == 1
+
+
+def test_get_snake_async_does_not_block_event_loop(deep_workflow):
+    import asyncio
+    from snakehelper.SnakeIOHelper import get_snake_async
+    from snakehelper.resolved import ResolvedIO
+
+    target = ['rec1/processed/curated.pkl']
+    options = dict(change_working_dir=False, createFolder=False, return_snake_obj=True,
+                   memory_cache=False, use_daemon=False, virtual_inputs=True)
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        results = await asyncio.gather(
+            get_snake_async({}, deep_workflow, target, 'sorted_to_curated', **options),
+            get_snake_async({}, deep_workflow, target, 'raw_to_filtered', executor='process',
+                            **options))
+        task.cancel()
+        # The synchronous API also works while a loop is running, as in Jupyter
+        sync = getSnake({}, deep_workflow, target, 'filtered_to_sorted', **options)
+        return ticks, results, sync
+
+    ticks, (thread_result, process_result), sync = asyncio.run(main())
+
+    assert ticks > 5
+    assert thread_result[2].name == 'sorted_to_curated'
+    assert isinstance(process_result[2], ResolvedIO)
+    assert process_result[0].raw == 'rec1/raw.dat'
+    assert process_result[2].timing.phases['build_dag'].calls == 1
+    assert sync[2].name == 'filtered_to_sorted'
+
+
+def test_prefetch_is_collected_by_get_snake(deep_workflow):
+    from snakehelper.prefetch import prefetch
+    from snakehelper.resolved import ResolvedIO
+
+    target = ['rec1/processed/curated.pkl']
+    options = dict(change_working_dir=False, createFolder=False, return_snake_obj=True,
+                   memory_cache=False, use_daemon=False, virtual_inputs=True)
+
+    future = prefetch(deep_workflow, target, virtual_inputs=True, change_working_dir=False)
+    _in, _out, job = getSnake({}, deep_workflow, target, 'sorted_to_curated', **options)
+    assert future.done()
+    assert job is future.result().getInputOutput4rule('sorted_to_curated')
+    assert job.timing.phases['prefetch_wait'].calls == 1
+    assert 'parse' not in job.timing.phases  # the compile happened in the prefetch
+
+    prefetch(deep_workflow, target, 'raw_to_filtered', virtual_inputs=True, executor='process',
+             change_working_dir=False)
+    sinput, _out, record = getSnake({}, deep_workflow, target, 'raw_to_filtered', **options)
+    assert isinstance(record, ResolvedIO)
+    assert sinput.raw == 'rec1/raw.dat'
+    assert 'parse' not in record.timing.phases
+
+    # A stat-free prefetch is only collected by a stat-free getSnake
+    future = prefetch(deep_workflow, target, stat_free=True, change_working_dir=False)
+    _in, _out, job = getSnake({}, deep_workflow, target, 'sorted_to_curated', **options)
+    assert 'parse' in job.timing.phases
+    stat_free_options = dict(options, virtual_inputs=False, stat_free=True)
+    _in, _out, job = getSnake({}, deep_workflow, target, 'sorted_to_curated', **stat_free_options)
+    assert job is future.result().getInputOutput4rule('sorted_to_curated')
+    assert 'parse' not in job.timing.phases
+
+
+def test_stderr_capture_keeps_head_and_tail_and_spills():
+    from snakehelper.capture import StderrCapture
+
+    capture = StderrCapture(head_size=10, tail_size=10, spill_threshold=100)
+    text = ''.join(f'line {i}\n' for i in range(100))
+    for line in text.splitlines(keepends=True):
+        capture.write(line)
+
+    assert capture.spilled and capture.truncated
+    assert capture.getvalue() == text
+    assert ''.join(capture.iter_text(chunk_size=7)) == text
+    summary = capture.summary()
+    assert summary.startswith(text[:10]) and summary.endswith(text[-10:])
+    assert f'[{len(text) - 20} characters omitted]' in summary
+
+    capture.close()
+    assert capture.summary() == summary
+    with pytest.raises(ValueError):
+        capture.getvalue()
+
+    small = StderrCapture(head_size=10, tail_size=10)
+    small.write('short\n')
+    small.write('text')
+    assert small.summary() == small.getvalue() == 'short\ntext'
+
+
+def test_iter_jobs_filters_and_lazy_log_files(deep_workflow):
+    from snakehelper.SnakeIOHelper import IOParser
+
+    targets = [f'rec{i}/processed/curated.pkl' for i in range(4)]
+    parser = IOParser(deep_workflow, targets, virtual_inputs=True)
+
+    assert len(list(parser.iter_jobs())) == 12
+    assert len(list(parser.iter_jobs(rule=['raw_to_filtered', 'sorted_to_curated']))) == 8
+    jobs = list(parser.iter_jobs(rule='sorted_to_curated', wildcards={'recording': 'rec2'}))
+    assert [j.wildcards.recording for j in jobs] == ['rec2']
+    jobs = parser.iter_jobs(wildcards=lambda wc: wc.recording in ('rec0', 'rec3'),
+                            output='rec*/processed/curated.pkl')
+    assert sorted(j.wildcards.recording for j in jobs) == ['rec0', 'rec3']
+
+    # Log files are only looked up for the rules that are queried
+    assert parser.log_files._found == {}
+    assert parser.log_files['sorted_to_curated'].endswith('processed/curate.log')
+    assert list(parser.log_files._found) == ['sorted_to_curated']
+    assert 'no_such_rule' not in parser.log_files
+    assert 'sorted_to_curated' in dict(parser.log_files)
+
+
+def test_stat_free_mode_makes_no_metadata_calls(monkeypatch, deep_workflow):
+    from snakehelper.SnakeIOHelper import IOParser
+
+    calls = []
+    original_stat = os.stat
+
+    def counting_stat(path, *args, **kwargs):
+        if 'rec1' in os.fsdecode(path):
+            calls.append(path)
+        return original_stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'stat', counting_stat)
+
+    IOParser(deep_workflow, ['rec1/processed/curated.pkl'], virtual_inputs=True)
+    assert calls  # the raw inputs are checked in virtual_inputs mode
+    calls.clear()
+    parser = IOParser(deep_workflow, ['rec1/processed/curated.pkl'], stat_free=True)
+    assert calls == []
+    assert len(list(parser.iter_jobs())) == 3
+    assert parser.missing_inputs == set()
+
+
+def test_prefetch_leaves_main_thread_stderr_alone(capsys, deep_workflow):
+    from snakehelper.prefetch import prefetch
+
+    future = prefetch(deep_workflow, ['rec2/processed/curated.pkl'], virtual_inputs=True,
+                      change_working_dir=False)
+    written = 0
+    while not future.done():
+        print(f'main thread {written}', file=sys.stderr)
+        written += 1
+    parser = future.result()
+
+    assert written > 0
+    assert 'main thread' not in parser.captured_stderr.getvalue()
+    assert capsys.readouterr().err.count('main thread') == written
+    assert type(sys.stderr).__name__ != '_ThreadRoutedStream'
+
+
+def test_repeated_prepare_logger_keeps_one_log_thread(tmp_path, monkeypatch):
+    import threading
+
+    from loguru import logger
+
+    from snakehelper.SnakeIOHelper import StreamToLogger, prepare_logger
+
+    def log_threads():
+        return {t for t in threading.enumerate() if t.name == 'snakehelper-log'}
+
+    monkeypatch.setattr(sys, 'stderr', sys.stderr)  # restored after the test
+    before = log_threads()  # left by earlier tests that did not close their stream
+    try:
+        for i in range(5):
+            prepare_logger(str(tmp_path / f'run{i}.log'))
+            print(f'message {i}', file=sys.stderr)
+        assert len(log_threads() - before) == 1
+        assert isinstance(sys.stderr, StreamToLogger)
+        sys.stderr.close()
+        # Each log file got the stderr written while it was the current one
+        assert 'message 0' in (tmp_path / 'run0.log').read_text()
+        assert 'message 4' in (tmp_path / 'run4.log').read_text()
+    finally:
+        logger.remove()
+        logger.add(sys.__stderr__)
+
+
+def test_errors_go_to_the_log_of_the_selected_job(monkeypatch, deep_workflow):
+    import snakehelper.SnakeIOHelper as mod
+
+    targets = [f'rec{i}/processed/curated.pkl' for i in (0, 1)]
+
+    def fail(_output):
+        raise RuntimeError('cannot create folders')
+
+    monkeypatch.setattr(mod, 'makeFolders', fail)
+    with pytest.raises(RuntimeError):
+        getSnake({}, deep_workflow, targets, 'sorted_to_curated', change_working_dir=False,
+                 memory_cache=False, use_daemon=False, virtual_inputs=True)
+
+    assert 'cannot create folders' in Path('rec0/processed/curate.log').read_text()
+    assert not Path('rec1/processed/curate.log').exists()
+
+
+def test_full_stderr_text_is_kept_until_the_parser_is_closed(tmp_path, monkeypatch):
+    from snakehelper.cache import ParserCache
+    from snakehelper.SnakeIOHelper import IOParser
+
+    monkeypatch.chdir(tmp_path)
+    lines = 'import sys\nfor i in range(20000):\n    print(f"line {i}", file=sys.stderr)\n'
+    rule = 'rule a:\n    output: "out.txt"\n    shell: "touch {output}"\n'
+    monkeypatch.setattr(IOParser, 'stderr_capture_options',
+                        {'head_size': 100, 'tail_size': 100, 'spill_threshold': 1000})
+
+    Path('Snakefile').write_text(lines + rule)
+    parser = IOParser('Snakefile', ['out.txt'])
+    capture = parser.captured_stderr
+    full_text = capture.getvalue()
+    assert capture.spilled and full_text.count('line ') == 20000
+
+    # Dropping the parser from a cache releases the full text, keeping head and tail
+    cache = ParserCache(maxsize=1)
+    cache.put('Snakefile', ['out.txt'], parser)
+    cache.clear()
+    summary = capture.summary()
+    assert not capture.spilled and summary.startswith('line 0\n')
+    assert summary.endswith(full_text[-100:])
+
+    # A failed compile hands its capture over with the exception
+    Path('Snakefile').write_text(lines + 'raise ValueError("broken")\n' + rule)
+    with pytest.raises(Exception) as info:
+        IOParser('Snakefile', ['out.txt'])
+    assert info.value.captured_stderr.getvalue().count('line ') == 20000
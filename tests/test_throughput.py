@@ -0,0 +1,43 @@
+import json
+
+from snakehelper import main
+from snakehelper.throughput import parse_size, write_synthetic
+
+
+def test_synthetic_files(tmp_path):
+    assert parse_size('64K') == 65536
+    assert parse_size('1.5MiB') == 1572864
+    assert write_synthetic(tmp_path / 'a/sparse.dat', 1 << 20) == 1 << 20
+    assert (tmp_path / 'a/sparse.dat').stat().st_size == 1 << 20
+    assert write_synthetic(tmp_path / 'fallocated.dat', 8192, 'fallocate') == 8192
+    assert (tmp_path / 'fallocated.dat').stat().st_size == 8192
+    assert write_synthetic(tmp_path / 'empty.dat', 8192, 'empty') == 0
+
+
+def test_throughput_harness_runs_whole_dag(tmp_path, deep_workflow):
+    targets = [f'rec{i}/processed/curated.pkl' for i in range(2)]
+
+    assert main(['throughput', '--snakefile', deep_workflow, '--targets', *targets, '--size', '4K',
+                 '--jobs', '2', '--virtual-inputs', '--workdir', str(tmp_path),
+                 '--output', str(tmp_path / 'report.json')]) == 0
+    report = json.loads((tmp_path / 'report.json').read_text())
+
+    assert report['jobs'] == 6
+    assert report['raw_input_bytes'] == 4 * 4096  # raw.dat and curation_params.json
+    assert [step['rule'] for step in report['critical_path']] == \
+        ['raw_to_filtered', 'filtered_to_sorted', 'sorted_to_curated']
+    curated = report['rules']['sorted_to_curated']
+    assert curated['jobs'] == 2
+    assert curated['input_bytes'] == 4 * 4096
+    assert curated['output_bytes'] == 2 * 4096
+    assert curated['critical_path_s'] > 0
+    assert report['critical_path_s'] <= report['serial_s']
+    for target in targets:
+        assert (tmp_path / target).stat().st_size == 4096
+    # Jobs ran in dependency order
+    starts = {(r['rule'], r['wildcards']['recording']): r['start_s'] for r in report['job_results']}
+    ends = {(r['rule'], r['wildcards']['recording']): r['start_s'] + r['wall_s']
+            for r in report['job_results']}
+    for rec in ('rec0', 'rec1'):
+        assert ends[('raw_to_filtered', rec)] <= starts[('filtered_to_sorted', rec)]
+        assert ends[('filtered_to_sorted', rec)] <= starts[('sorted_to_curated', rec)]
@@ -0,0 +1,77 @@
+import sys
+import time
+
+from snakehelper.SnakeIOHelper import getSnake
+from snakehelper.watch import WorkflowWatcher, stop_all
+
+
+def _wait_for(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('Timed out waiting for the watcher')
+        time.sleep(0.05)
+
+
+def test_watcher_recompiles_in_background(workflow_copy):
+    watcher = WorkflowWatcher(str(workflow_copy), ['tests/processed/recording_info.pkl'],
+                              interval=0.05)
+    try:
+        first = watcher.parser
+        assert watcher.parser is first  # no recompile without changes
+        assert first.log_files['sort_spikes'] == 'tests/processed/snakemake.log'
+
+        workflow_copy.write_text(workflow_copy.read_text().replace('snakemake.log', 'edited.log'))
+        _wait_for(lambda: watcher.compile_count == 2)
+
+        assert watcher.parser is not first
+        assert watcher.parser.log_files['sort_spikes'] == 'tests/processed/edited.log'
+    finally:
+        watcher.stop()
+
+
+def test_getSnake_watch_reuses_compiled_workflow(workflow_copy):
+    args = (str(workflow_copy), ['tests/processed/recording_info.pkl'], 'sort_spikes')
+    try:
+        _, _, job1 = getSnake({}, *args, change_working_dir=False, createFolder=False,
+                              return_snake_obj=True, watch=True)
+        _, _, job2 = getSnake({}, *args, change_working_dir=False, createFolder=False,
+                              return_snake_obj=True, watch=True)
+        assert job1 is job2
+    finally:
+        stop_all()
+
+
+def test_watcher_recompile_leaves_stderr_alone(workflow_copy, capsys):
+    watcher = WorkflowWatcher(str(workflow_copy), ['tests/processed/recording_info.pkl'],
+                              interval=0.05)
+    try:
+        workflow_copy.write_text(workflow_copy.read_text().replace('snakemake.log', 'edited.log'))
+        written = 0
+        deadline = time.monotonic() + 10.0
+        while watcher.compile_count < 2:
+            assert time.monotonic() < deadline, 'Timed out waiting for the watcher'
+            print(f'kernel output {written}', file=sys.stderr)
+            written += 1
+            time.sleep(0.001)
+        assert 'kernel output' not in watcher.parser.captured_stderr.getvalue()
+        assert capsys.readouterr().err.count('kernel output') == written
+    finally:
+        watcher.stop()
+
+
+def test_missing_source_does_not_trigger_recompile_loop(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'config.yaml').write_text('name: out\n')
+    (tmp_path / 'Snakefile').write_text(
+        'configfile: "config.yaml"\n'
+        'rule a:\n    output: "out.txt"\n    shell: "touch {output}"\n')
+    watcher = WorkflowWatcher('Snakefile', ['out.txt'], interval=0.05)
+    try:
+        assert watcher.parser is not None
+        (tmp_path / 'config.yaml').unlink()
+        _wait_for(lambda: watcher.compile_count >= 2)
+        time.sleep(1.0)
+        assert watcher.compile_count <= 3
+    finally:
+        watcher.stop()